@@ -1,23 +1,59 @@
 """
 Flask веб-приложение для анализа связей в книгах.
 """
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, render_template, request, jsonify, send_from_directory
 import os
 import json
-import chardet
+import hashlib
+import gc
+import gzip
+import shutil
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import NotFound
 from entity_extractor import EntityExtractor
 from relation_extractor import RelationExtractor
 from ontology_builder import OntologyBuilder
 from graph_visualizer import GraphVisualizer
+from text_encoding import decode_text
 from pathlib import Path
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+import threading
 import tempfile
+import socket
+import time
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def write_json(filepath: str, data) -> None:
+    """Сохраняет данные в JSON (UTF-8, с отступами); использует orjson, если он установлен."""
+    if orjson is not None:
+        with open(filepath, 'wb') as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+    else:
+        with open(filepath, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def read_json(filepath: str):
+    """Загружает данные из JSON файла; использует orjson, если он установлен."""
+    if orjson is not None:
+        with open(filepath, 'rb') as f:
+            return orjson.loads(f.read())
+    with open(filepath, 'r', encoding='utf-8') as f:
+        return json.load(f)
 
 
 def read_text_file(filepath: str) -> str:
     """
     Читает текстовый файл с автоматическим определением кодировки.
     Пробует несколько кодировок, если не удается определить автоматически.
+    Файл читается с диска один раз, все попытки декодирования идут в памяти.
     
     Args:
         filepath: Путь к файлу
@@ -25,51 +61,71 @@ def read_text_file(filepath: str) -> str:
     Returns:
         Текст файла в виде строки
     """
-    # Список кодировок для попытки чтения
-    encodings = ['utf-8', 'windows-1251', 'cp866', 'iso-8859-5', 'utf-8-sig']
-    
-    # Пробуем определить кодировку автоматически
-    try:
-        with open(filepath, 'rb') as f:
-            raw_data = f.read()
-            detected = chardet.detect(raw_data)
-            if detected and detected['encoding']:
-                encodings.insert(0, detected['encoding'])
-    except Exception:
-        pass  # Если не удалось определить, используем список по умолчанию
-    
-    # Пробуем прочитать файл с разными кодировками
-    for encoding in encodings:
-        try:
-            with open(filepath, 'r', encoding=encoding) as f:
-                text = f.read()
-                return text
-        except (UnicodeDecodeError, LookupError):
-            continue
-    
-    # Если ничего не сработало, пробуем с ошибками
-    try:
-        with open(filepath, 'r', encoding='utf-8', errors='replace') as f:
-            return f.read()
-    except Exception as e:
-        raise ValueError(f"Не удалось прочитать файл. Возможна проблема с кодировкой: {e}")
+    return decode_text(Path(filepath).read_bytes())
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB максимум
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['RESULTS_FOLDER'] = 'results'
+# Статусы фоновых задач хранятся отдельно: папка результатов раздается через /results
+app.config['JOBS_FOLDER'] = 'jobs'
+# Результаты неизменны для данного result_id, поэтому браузер может их кэшировать
+app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 3600
 
 # Создаем папки, если их нет
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['RESULTS_FOLDER'], exist_ok=True)
+os.makedirs(app.config['JOBS_FOLDER'], exist_ok=True)
 
 ALLOWED_EXTENSIONS = {'txt'}
 
+# Размер текста (в символах), начиная с которого память освобождается принудительно
+LARGE_TEXT_SIZE = 5 * 1024 * 1024
+
+# Процессы Natasha для длинных книг в веб-приложении. По умолчанию без пула:
+# каждый воркер gunicorn создал бы свой пул, и каждый процесс пула заново
+# загружал бы модели; параллелизм включается переменной ENTITY_WORKERS
+APP_ENTITY_WORKERS = int(os.environ.get('ENTITY_WORKERS', 1))
+
+# Фоновая обработка загрузок (/upload?async=1): запрос не ждет окончания анализа.
+# Статус задачи (pending/error) хранится в файле {result_id}.status в папке
+# задач, чтобы его видели все воркеры gunicorn, а не только запустивший
+ANALYSIS_WORKERS = 2
+# Задача, которая дольше этого времени (в секундах) остается в статусе pending,
+# считается прерванной (например, воркер на другом хосте был остановлен)
+ANALYSIS_JOB_TIMEOUT = 3 * 60 * 60
+analysis_executor = ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS)
+analysis_jobs = {}  # {result_id: Future} - задачи этого процесса, пока они выполняются
+analysis_jobs_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def get_entity_extractor() -> EntityExtractor:
+    """
+    Возвращает общий экземпляр EntityExtractor.
+    Модели Natasha и pymorphy2 загружаются один раз на процесс, а не на каждый запрос.
+    """
+    return EntityExtractor(workers=APP_ENTITY_WORKERS)
+
+
+@lru_cache(maxsize=None)
+def get_relation_extractor() -> RelationExtractor:
+    """Возвращает общий экземпляр RelationExtractor."""
+    return RelationExtractor()
+
 def allowed_file(filename):
     """Проверяет, разрешено ли расширение файла."""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+def make_result_id(filename: str, data: bytes) -> str:
+    """
+    Строит идентификатор результата из имени файла и хэша содержимого.
+    BLAKE2b детерминирован между запусками, в отличие от встроенного hash().
+    """
+    return Path(filename).stem + '_' + hashlib.blake2b(data, digest_size=6).hexdigest()
+
+
 @app.route('/')
 def index():
     """Главная страница с формой загрузки."""
@@ -78,7 +134,11 @@ def index():
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
-    """Обработка загрузки и анализ файла."""
+    """
+    Обработка загрузки и анализ файла.
+    С параметром ?async=1 анализ ставится в фоновую очередь и сразу
+    возвращается 202 с адресом для опроса статуса.
+    """
     if 'file' not in request.files:
         return jsonify({'error': 'Файл не загружен'}), 400
     
@@ -91,114 +151,286 @@ def upload_file():
         return jsonify({'error': 'Разрешены только .txt файлы'}), 400
     
     try:
-        # Сохраняем файл
+        # Сохраняем файл: загрузка ограничена MAX_CONTENT_LENGTH, поэтому читаем ее
+        # в память целиком и пишем одним вызовом, без повторного чтения с диска
         filename = secure_filename(file.filename)
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+        raw_data = file.read()
+        Path(filepath).write_bytes(raw_data)
         
-        # Читаем текст с определением кодировки
-        text = read_text_file(filepath)
+        # Декодируем текст с определением кодировки
+        text = decode_text(raw_data)
         
         if len(text.strip()) == 0:
             return jsonify({'error': 'Файл пуст'}), 400
         
-        # Обрабатываем текст
-        result = process_book(text, filename)
+        # Идентификатор результата считается один раз по байтам файла
+        result_id = make_result_id(filename, raw_data)
         
-        # Сохраняем результаты (без ontology_builder, т.к. это объект)
-        result_id = filename.rsplit('.', 1)[0] + '_' + str(hash(text) % 1000000)
-        result_file = os.path.join(app.config['RESULTS_FOLDER'], f'{result_id}.json')
+        # Байты файла больше не нужны, дальше работаем с текстом
+        del raw_data
         
-        # Создаем копию результата без объекта ontology_builder для JSON
-        result_for_json = {k: v for k, v in result.items() if k != 'ontology_builder'}
+        # Эта же книга уже обрабатывалась - отдаем сохраненный результат без повторного анализа
+        saved = load_saved_result(result_id)
+        if saved is not None:
+            return jsonify({'success': True, 'status': 'done', **saved})
         
-        with open(result_file, 'w', encoding='utf-8') as f:
-            json.dump(result_for_json, f, ensure_ascii=False, indent=2)
-        
-        # Сохраняем граф
-        graph_file = os.path.join(app.config['RESULTS_FOLDER'], f'{result_id}_graph.html')
-        result['graph_file'] = graph_file
-        
-        # Сохраняем OWL онтологию
-        owl_file = os.path.join(app.config['RESULTS_FOLDER'], f'{result_id}_ontology.owl')
-        result['ontology_builder'].export_to_owl(owl_file, ontology_name=filename.rsplit('.', 1)[0])
-        result['owl_file'] = owl_file
+        if request.args.get('async'):
+            with analysis_jobs_lock:
+                # Завершенные задачи удаляются из словаря, поэтому повторно в очередь
+                # ставится книга, прошлый анализ которой в этом процессе упал
+                if result_id not in analysis_jobs:
+                    write_job_status(result_id, 'pending')
+                    analysis_jobs[result_id] = analysis_executor.submit(
+                        run_analysis_job, text, filename, result_id
+                    )
+            return jsonify({
+                'status': 'pending',
+                'result_id': result_id,
+                'status_url': f'/status/{result_id}'
+            }), 202
         
         # Возвращаем результаты
-        return jsonify({
-            'success': True,
-            'result_id': result_id,
-            'statistics': result['statistics'],
-            'graph_file': f'/results/{result_id}_graph.html',
-            'owl_file': f'/results/{result_id}_ontology.owl'
-        })
+        return jsonify({'success': True, **analyze_and_save(text, filename, result_id)})
     
     except Exception as e:
         return jsonify({'error': f'Ошибка обработки: {str(e)}'}), 500
 
 
-def process_book(text: str, filename: str) -> dict:
+@app.route('/status/<result_id>')
+def analysis_status(result_id):
+    """
+    Статус фонового анализа, запущенного через /upload?async=1.
+    Статус читается из файлов в папках результатов и задач, поэтому опрос
+    может попасть в любой воркер, а не только в тот, который ведет анализ.
+    """
+    saved = load_saved_result(result_id)
+    if saved is not None:
+        return jsonify({'status': 'done', 'success': True, **saved})
+    
+    job_status = read_job_status(result_id)
+    if job_status is None:
+        return jsonify({'error': 'Результат не найден'}), 404
+    
+    if job_status['status'] == 'pending' and job_is_stale(job_status):
+        # Процесс, который вел анализ, остановился, не записав результат
+        job_status = {'status': 'error', 'error': 'Анализ прерван: обработчик остановлен. Загрузите файл повторно'}
+        write_job_status(result_id, job_status['status'], job_status['error'])
+    
+    if job_status['status'] == 'error':
+        return jsonify({'status': 'error', 'error': job_status['error']}), 500
+    
+    return jsonify({'status': 'pending', 'result_id': result_id})
+
+
+def job_status_file(result_id: str) -> str:
+    """Путь к файлу статуса фонового анализа."""
+    return os.path.join(app.config['JOBS_FOLDER'], f'{result_id}.status')
+
+
+def write_job_status(result_id: str, status: str, error: Optional[str] = None) -> None:
+    """
+    Записывает статус фонового анализа ('pending' или 'error') вместе с
+    процессом, который ведет анализ, и временем записи.
+    Файл заменяется атомарно, чтобы другой воркер не прочитал его наполовину.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=app.config['JOBS_FOLDER'], suffix='.tmp')
+    os.close(fd)
+    write_json(tmp_path, {
+        'status': status,
+        'error': error,
+        'host': socket.gethostname(),
+        'pid': os.getpid(),
+        'started': time.time(),
+    })
+    os.replace(tmp_path, job_status_file(result_id))
+
+
+def read_job_status(result_id: str) -> Optional[dict]:
+    """Возвращает статус фонового анализа или None, если задачи не было."""
+    try:
+        return read_json(job_status_file(result_id))
+    except FileNotFoundError:
+        return None
+
+
+def job_is_stale(job_status: dict) -> bool:
+    """
+    Проверяет, что задача в статусе pending уже не выполняется: процесс,
+    записавший статус на этом хосте, завершился, или истек ANALYSIS_JOB_TIMEOUT.
+    """
+    if time.time() - job_status.get('started', 0) > ANALYSIS_JOB_TIMEOUT:
+        return True
+    if job_status.get('host') != socket.gethostname():
+        return False
+    try:
+        os.kill(job_status['pid'], 0)  # Сигнал 0 только проверяет, что процесс существует
+    except ProcessLookupError:
+        return True
+    except (PermissionError, KeyError):
+        pass
+    return False
+
+
+def run_analysis_job(text: str, filename: str, result_id: str) -> dict:
+    """
+    Фоновая задача /upload?async=1: анализирует книгу и обновляет файл статуса.
+    После завершения (успешного или нет) задача удаляется из analysis_jobs.
+    """
+    try:
+        summary = analyze_and_save(text, filename, result_id)
+    except Exception as e:
+        write_job_status(result_id, 'error', f'Ошибка обработки: {str(e)}')
+        raise
+    else:
+        # Результаты сохранены - статус теперь определяется по ним
+        try:
+            os.remove(job_status_file(result_id))
+        except FileNotFoundError:
+            pass
+        return summary
+    finally:
+        with analysis_jobs_lock:
+            analysis_jobs.pop(result_id, None)
+
+
+def load_saved_result(result_id: str) -> Optional[dict]:
+    """
+    Возвращает сводку по ранее сохраненному результату или None,
+    если какого-то из файлов (JSON, граф, OWL) нет.
+    """
+    result_file = os.path.join(app.config['RESULTS_FOLDER'], f'{result_id}.json')
+    graph_file = os.path.join(app.config['RESULTS_FOLDER'], f'{result_id}_graph.html')
+    owl_file = os.path.join(app.config['RESULTS_FOLDER'], f'{result_id}_ontology.owl')
+    if not all(os.path.exists(path) for path in (result_file, graph_file, owl_file)):
+        return None
+    
+    statistics = read_json(result_file)['statistics']
+    
+    return {
+        'result_id': result_id,
+        'statistics': statistics,
+        'graph_file': f'/results/{result_id}_graph.html',
+        'owl_file': f'/results/{result_id}_ontology.owl'
+    }
+
+
+def analyze_and_save(text: str, filename: str, result_id: str) -> dict:
+    """
+    Анализирует текст и сохраняет результаты (JSON, граф, OWL) в папку результатов.
+    
+    Args:
+        text: Текст книги
+        filename: Имя файла
+        result_id: Идентификатор результата
+        
+    Returns:
+        Краткая сводка для ответа клиенту (статистика и ссылки на файлы)
+    """
+    # Обрабатываем текст
+    result = process_book(text, filename, result_id)
+    
+    # Сохраняем результаты (без ontology_builder, т.к. это объект)
+    result_file = os.path.join(app.config['RESULTS_FOLDER'], f'{result_id}.json')
+    
+    # Создаем копию результата без объекта ontology_builder для JSON
+    result_for_json = {k: v for k, v in result.items() if k != 'ontology_builder'}
+    
+    write_json(result_file, result_for_json)
+    
+    # Сохраняем граф
+    graph_file = os.path.join(app.config['RESULTS_FOLDER'], f'{result_id}_graph.html')
+    result['graph_file'] = graph_file
+    
+    # Сохраняем OWL онтологию
+    owl_file = os.path.join(app.config['RESULTS_FOLDER'], f'{result_id}_ontology.owl')
+    result['ontology_builder'].export_to_owl(owl_file, ontology_name=filename.rsplit('.', 1)[0])
+    result['owl_file'] = owl_file
+    
+    return {
+        'result_id': result_id,
+        'statistics': result['statistics'],
+        'graph_file': f'/results/{result_id}_graph.html',
+        'owl_file': f'/results/{result_id}_ontology.owl'
+    }
+
+
+def process_book(text: str, filename: str, result_id: str) -> dict:
     """
     Обрабатывает текст книги и возвращает результаты.
     
     Args:
         text: Текст книги
         filename: Имя файла
+        result_id: Идентификатор результата (вычисляется вызывающей стороной один раз)
         
     Returns:
         Словарь с результатами анализа
     """
     # Шаг 1: Извлечение сущностей
-    entity_extractor = EntityExtractor()
+    entity_extractor = get_entity_extractor()
     entities = entity_extractor.extract_entities(text)
     
     # Шаг 2: Извлечение связей
-    relation_extractor = RelationExtractor()
+    relation_extractor = get_relation_extractor()
     relations = relation_extractor.extract_relations(text, entities)
     
     # Шаг 3: Построение онтологии
     ontology_builder = OntologyBuilder()
     ontology = ontology_builder.build_ontology(entities, relations)
     statistics = ontology_builder.get_statistics()
+    text_length = len(text)
+    
+    # Онтология хранит собственные копии сущностей и связей - исходные списки
+    # больше не нужны; для больших книг сразу возвращаем память до визуализации
+    del entities, relations
+    if text_length > LARGE_TEXT_SIZE:
+        gc.collect()
     
     # Шаг 4: Визуализация графа
-    result_id = filename.rsplit('.', 1)[0] + '_' + str(hash(text) % 1000000)
     graph_file = os.path.join(app.config['RESULTS_FOLDER'], f'{result_id}_graph.html')
     
     graph_visualizer = GraphVisualizer()
     graph = graph_visualizer.build_graph(ontology)
     graph_visualizer.visualize_interactive(output_file=graph_file)
     
-    # Подготавливаем данные для отображения
-    entities_list = []
-    for name, data in ontology['entities'].items():
-        entities_list.append({
+    # Сжатая копия графа: HTML от pyvis может весить несколько мегабайт
+    with open(graph_file, 'rb') as src, gzip.open(graph_file + '.gz', 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    
+    # Подготавливаем данные для отображения (один проход по онтологии)
+    entities_list = [
+        {
             'name': name,
             'type': data['type'],
             'mentions': data['attributes'].get('mentions', 0),
             'relations_count': data['attributes'].get('total_relations', 0)
-        })
+        }
+        for name, data in ontology['entities'].items()
+    ]
     
-    relations_list = []
-    for rel in ontology['relations']:
-        relations_list.append({
-            'source': rel['source'],
-            'target': rel['target'],
-            'type': rel['type'],
-            'confidence': rel.get('confidence', 0.5),
-            'context': rel.get('context', '')[:100]
-        })
+    relations_list = [
+        {
+            'source': rel.source,
+            'target': rel.target,
+            'type': rel.type,
+            'confidence': rel.confidence,
+            'context': rel.context[:100]
+        }
+        for rel in ontology['relations']
+    ]
     
-    # Преобразуем онтологию для JSON сериализации (set -> list)
+    # Преобразуем онтологию для JSON сериализации (Relation -> dict);
+    # список типов связей берется из статистики
     ontology_serializable = {
         'entities': ontology['entities'],
-        'relations': ontology['relations'],
-        'relation_types': list(ontology['relation_types'])  # Преобразуем set в list
+        'relations': [rel.to_dict() for rel in ontology['relations']],
+        'relation_types': list(statistics['relation_types'])
     }
     
     return {
         'filename': filename,
-        'text_length': len(text),
+        'text_length': text_length,
         'statistics': statistics,
         'entities': entities_list,
         'relations': relations_list,
@@ -210,11 +442,24 @@ def process_book(text: str, filename: str) -> dict:
 
 @app.route('/results/<filename>')
 def serve_result(filename):
-    """Отдает сохраненный граф."""
-    filepath = os.path.join(app.config['RESULTS_FOLDER'], filename)
-    if os.path.exists(filepath):
-        return send_file(filepath)
-    return jsonify({'error': 'Файл не найден'}), 404
+    """
+    Отдает сохраненный граф.
+    Поддерживает условные запросы (ETag/If-Modified-Since) и Range;
+    HTML отдается в сжатом виде, если клиент принимает gzip.
+    """
+    directory = os.path.abspath(app.config['RESULTS_FOLDER'])
+    max_age = app.config['SEND_FILE_MAX_AGE_DEFAULT']
+    try:
+        if (filename.endswith('.html') and 'gzip' in request.accept_encodings
+                and os.path.exists(os.path.join(directory, filename + '.gz'))):
+            response = send_from_directory(directory, filename + '.gz', mimetype='text/html',
+                                           conditional=True, max_age=max_age)
+            response.headers['Content-Encoding'] = 'gzip'
+            response.headers['Vary'] = 'Accept-Encoding'
+            return response
+        return send_from_directory(directory, filename, conditional=True, max_age=max_age)
+    except NotFound:
+        return jsonify({'error': 'Файл не найден'}), 404
 
 
 @app.route('/analyze', methods=['POST'])
@@ -231,7 +476,9 @@ def analyze_direct():
         return jsonify({'error': 'Текст пуст'}), 400
     
     try:
-        result = process_book(text, 'direct_input.txt')
+        filename = 'direct_input.txt'
+        result_id = make_result_id(filename, text.encode('utf-8'))
+        result = process_book(text, filename, result_id)
         return jsonify({
             'success': True,
             'result': result
@@ -248,6 +495,7 @@ if __name__ == '__main__':
     print(f"📊 Результаты: {app.config['RESULTS_FOLDER']}")
     print()
     print("Откройте в браузере: http://127.0.0.1:5000")
+    print("Для production: gunicorn --preload -w 4 -k gthread --threads 2 wsgi:application")
     print("=" * 80)
     app.run(debug=True, host='0.0.0.0', port=5000)
 
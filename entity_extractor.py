@@ -3,40 +3,221 @@
 Использует Natasha для распознавания персон и локаций.
 Использует pymorphy2 для правильной нормализации падежей.
 Использует transformers с русской моделью как резервный метод.
+Опционально использует spaCy (NER_BACKEND=spacy) как основной движок.
 """
 from natasha import (
     Segmenter,
-    MorphVocab,
     NewsEmbedding,
-    NewsMorphTagger,
     NewsNERTagger,
     Doc
 )
 from pymorphy2 import MorphAnalyzer
-from typing import List, Dict, Set, Optional
+from typing import List, Dict, Set, Optional, Tuple
+from functools import lru_cache
+from collections import defaultdict
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import threading
+import importlib.util
+import os
 import re
 
-# Попытка импортировать transformers для более мощного NER
-try:
-    from transformers import AutoTokenizer, AutoModelForTokenClassification, pipeline
-    TRANSFORMERS_AVAILABLE = True
-except ImportError:
-    TRANSFORMERS_AVAILABLE = False
+# Проверяем наличие transformers без импорта: сам импорт тянет torch
+# и заметно замедляет старт, а нужен только в резервном методе
+TRANSFORMERS_AVAILABLE = importlib.util.find_spec('transformers') is not None
+if not TRANSFORMERS_AVAILABLE:
     print("ВНИМАНИЕ: transformers не установлен. Для лучшего поиска персон установите: pip install transformers torch")
 
+# Максимальное число слов в кэше разборов pymorphy2
+PARSE_CACHE_SIZE = 100_000
+# Число фрагментов текста в одном пакете для transformers pipeline
+NER_BATCH_SIZE = 8
+
+# Число процессов для обработки длинных текстов Natasha (1 - без параллелизма)
+ENTITY_WORKERS = int(os.environ.get('ENTITY_WORKERS', min(4, os.cpu_count() or 1)))
+# Способ запуска процессов пула: fork многопоточного процесса (Flask, gunicorn
+# --threads) может унаследовать захваченные другими потоками блокировки
+POOL_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+# Примерный размер части текста (в символах) для параллельной обработки
+PARALLEL_CHUNK_SIZE = 100_000
+
+# Основной NER-движок: 'natasha' (по умолчанию) или 'spacy'
+NER_BACKEND = os.environ.get('NER_BACKEND', 'natasha').lower()
+SPACY_MODEL = os.environ.get('SPACY_MODEL', 'ru_core_news_sm')
+# Число абзацев в одном пакете nlp.pipe
+SPACY_BATCH_SIZE = 64
+# Метки spaCy, соответствующие нашим типам сущностей
+SPACY_LABELS = {'PER': 'PERSON', 'LOC': 'LOC', 'ORG': 'ORG'}
+
+
+@lru_cache(maxsize=None)
+def _load_spacy_model(model_name: str):
+    """Загружает модель spaCy один раз на процесс (синтаксический разбор не нужен)."""
+    import spacy
+    return spacy.load(model_name, disable=['parser'])
+
+
+def _extract_spacy_batch(batch: Tuple[List[int], List[str]]) -> Dict[str, List[Dict]]:
+    """
+    Извлекает сущности spaCy из пакета абзацев (в текущем процессе или в процессе пула).
+    Нормализованная форма строится из лемм spaCy.
+    
+    Args:
+        batch: (смещения абзацев в исходном тексте, тексты абзацев)
+        
+    Returns:
+        Словарь сущностей с позициями относительно исходного текста
+    """
+    offsets, paragraphs = batch
+    nlp = _load_spacy_model(SPACY_MODEL)
+    entities = {
+        'PERSON': [],
+        'LOC': [],
+        'ORG': []
+    }
+    
+    for offset, doc in zip(offsets, nlp.pipe(paragraphs, batch_size=SPACY_BATCH_SIZE)):
+        for ent in doc.ents:
+            entity_type = SPACY_LABELS.get(ent.label_)
+            if entity_type is None:
+                continue
+            
+            normalized_parts = []
+            for token in ent:
+                lemma = token.lemma_ or token.text
+                # Сохраняем заглавную букву если была в оригинале
+                if token.text[:1].isupper():
+                    lemma = lemma[0].upper() + lemma[1:]
+                normalized_parts.append(lemma)
+            
+            entities[entity_type].append({
+                'text': ent.text,
+                'start': offset + ent.start_char,
+                'end': offset + ent.end_char,
+                'normalized': ' '.join(normalized_parts),
+                'chunks': []
+            })
+    
+    return entities
+
+
+def _split_long_line(line: str, limit: int) -> List[Tuple[int, str]]:
+    """
+    Делит строку длиннее limit символов на части по пробелам
+    (spaCy не принимает тексты длиннее nlp.max_length).
+    
+    Returns:
+        Список (смещение части в строке, текст части)
+    """
+    pieces = []
+    start = 0
+    while len(line) - start > limit:
+        cut = line.rfind(' ', start, start + limit)
+        cut = start + limit if cut <= start else cut + 1
+        pieces.append((start, line[start:cut]))
+        start = cut
+    pieces.append((start, line[start:]))
+    return pieces
+
+
+def split_on_paragraph_boundaries(text: str, target: int) -> List[Tuple[int, str]]:
+    """
+    Делит текст на части примерно по target символов, не разрывая абзацы.
+    
+    Returns:
+        Список (смещение части в тексте, текст части)
+    """
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = start + target
+        if end >= len(text):
+            chunks.append((start, text[start:]))
+            break
+        # Режем по ближайшей пустой строке, иначе по ближайшему переводу строки
+        cut = text.find('\n\n', end, end + target)
+        if cut == -1:
+            cut = text.find('\n', end)
+        if cut == -1:
+            chunks.append((start, text[start:]))
+            break
+        cut += 1
+        chunks.append((start, text[start:cut]))
+        start = cut
+    return chunks
+
+
+# Экземпляр EntityExtractor внутри процесса пула
+_worker_extractor = None
+
+
+def _init_worker():
+    """Загружает модели один раз при старте процесса пула."""
+    global _worker_extractor
+    _worker_extractor = EntityExtractor()
+
+
+def _extract_chunk(chunk: Tuple[int, str]):
+    """Обрабатывает часть текста в процессе пула и сдвигает позиции на смещение части."""
+    offset, text = chunk
+    entities, spans = _worker_extractor._extract_natasha_entities(text)
+    for entity_list in entities.values():
+        for entity in entity_list:
+            entity['start'] += offset
+            entity['end'] += offset
+    spans = [(start + offset, stop + offset, span_type) for start, stop, span_type in spans]
+    return entities, spans
+
+
+def _is_name_tag(tag) -> bool:
+    """
+    Строгая проверка тега pymorphy2 - должно быть имя (Name) или фамилия (Surn)
+    или одушевленное существительное в именительном падеже.
+    Граммемы проверяются по множеству, без построения строки тега.
+    """
+    grammemes = tag.grammemes
+    if 'Name' in grammemes or 'Surn' in grammemes:
+        return True
+    # Может быть одушевленное существительное (имя) в именительном падеже
+    return 'NOUN' in grammemes and 'anim' in grammemes and 'nomn' in grammemes
+
 
 class EntityExtractor:
     """Класс для извлечения имен собственных из текста."""
     
-    def __init__(self):
-        """Инициализация компонентов Natasha, pymorphy2 и transformers."""
+    def __init__(self, workers: int = ENTITY_WORKERS):
+        """
+        Инициализация компонентов Natasha, pymorphy2 и transformers.
+        
+        Args:
+            workers: Число процессов для длинных текстов (1 - без параллелизма)
+        """
+        self.workers = workers
         self.segmenter = Segmenter()
-        self.morph_vocab = MorphVocab()
         self.emb = NewsEmbedding()
-        self.morph_tagger = NewsMorphTagger(self.emb)
         self.ner_tagger = NewsNERTagger(self.emb)
         # Pymorphy2 для нормализации падежей
         self.morph = MorphAnalyzer()
+        # Кэш разборов pymorphy2: имена в книге повторяются сотни раз
+        self._parse_cache = {}
+        
+        # Регулярные выражения компилируются один раз на экземпляр
+        # Только паттерны где имя четко в контексте действия (более строгие).
+        # Проходы идут по порядку: совпадения объекта и субъекта перекрываются
+        # ("сказал Вера была"), поэтому в одном выражении одно из них терялось бы.
+        # Паттерн "имя и фамилия перед глаголом" отдельно не нужен: его глаголы -
+        # подмножество глаголов субъекта, а собственные совпадения содержат глагол
+        # и не проходят морфологическую проверку
+        name_re = r'[А-ЯЁA-Z][а-яёa-z]+(?:\s+[А-ЯЁA-Z][а-яёa-z]+)?'
+        self._person_patterns = (
+            # Имя перед глаголом (субъект действия) - самое надежное
+            re.compile(r'(' + name_re + r')\s+(?:сказал|сказала|думал|думала|работал|работала|жил|жила|был|была|стал|стала|родился|родилась|познакомился|познакомилась|встретил|встретила)', re.IGNORECASE),
+            # После глагола (объект) - менее надежно, но проверяем
+            re.compile(r'(?:сказал|сказала|встретил|встретила|познакомился|познакомилась|знал|знала|любил|любила)\s+(' + name_re + r')', re.IGNORECASE),
+        )
+        self._sentence_split_re = re.compile(r'[.!?]\s+')
+        self._word_split_re = re.compile(r'[\s-]+')
         
         # Трансформеры для более мощного NER (ленивая загрузка)
         self.ner_pipeline = None
@@ -51,6 +232,15 @@ class EntityExtractor:
                 self.use_transformers = False
         else:
             self.use_transformers = False
+        
+        # Пул процессов для длинных текстов (создается при первом использовании;
+        # экземпляр общий для потоков веб-приложения, поэтому под блокировкой)
+        self._pool = None
+        self._spacy_pool = None
+        self._pool_lock = threading.Lock()
+        
+        # spaCy как альтернативный основной движок (модель загружается при первом вызове)
+        self.use_spacy = NER_BACKEND == 'spacy' and importlib.util.find_spec('spacy') is not None
     
     def extract_entities(self, text: str) -> Dict[str, List[Dict]]:
         """
@@ -67,15 +257,57 @@ class EntityExtractor:
                 ...
             }
         """
+        # spaCy: если нашел персон, Natasha не запускаем
+        if self.use_spacy:
+            entities = self._extract_entities_with_spacy(text)
+            if entities['PERSON']:
+                entities['PERSON'] = self._normalize_persons(entities['PERSON'])
+                entities['LOC'] = self._normalize_locations(entities['LOC'])
+                return entities
+        
+        # Длинные тексты обрабатываются по частям в нескольких процессах
+        if self.workers > 1 and len(text) > 2 * PARALLEL_CHUNK_SIZE:
+            entities, spans = self._extract_natasha_entities_parallel(text)
+        else:
+            entities, spans = self._extract_natasha_entities(text)
+        
+        # Отладочный вывод для диагностики
+        if len(entities['PERSON']) == 0:
+            print(f"DEBUG: Natasha не нашел персон. Всего spans: {len(spans)}")
+            print(f"DEBUG: Типы найденных сущностей: {[s[2] for s in spans[:20]]}")
+            print("DEBUG: Пробую альтернативные методы...")
+        
+        # Если Natasha не нашел персон, используем альтернативные методы
+        if len(entities['PERSON']) == 0:
+            # Сначала пробуем через морфологию
+            persons_morph = self._extract_persons_with_morphology(text, spans)
+            entities['PERSON'].extend(persons_morph)
+            
+            # Если и это не помогло, пробуем transformers
+            if len(entities['PERSON']) == 0 and self.use_transformers:
+                persons_transformer = self._extract_persons_with_transformers(text)
+                entities['PERSON'].extend(persons_transformer)
+                print(f"DEBUG: Transformers нашел персон: {len(persons_transformer)}")
+        
+        # Дополнительная обработка для нормализации имен
+        entities['PERSON'] = self._normalize_persons(entities['PERSON'])
+        entities['LOC'] = self._normalize_locations(entities['LOC'])
+        
+        return entities
+    
+    def _extract_natasha_entities(self, text: str) -> Tuple[Dict[str, List[Dict]], List[Tuple[int, int, str]]]:
+        """
+        Прогоняет текст через Natasha.
+        
+        Returns:
+            Сущности до группировки и все найденные spans в виде (start, stop, type)
+        """
+        # Морфологическая разметка и леммы Natasha не нужны:
+        # нормальная форма строится через pymorphy2 по тексту span
         doc = Doc(text)
         doc.segment(self.segmenter)
-        doc.tag_morph(self.morph_tagger)
         doc.tag_ner(self.ner_tagger)
         
-        # Нормализуем токены для получения именительного падежа
-        for token in doc.tokens:
-            token.lemmatize(self.morph_vocab)
-        
         entities = {
             'PERSON': [],
             'LOC': [],
@@ -97,58 +329,115 @@ class EntityExtractor:
                     'chunks': span.chunks if hasattr(span, 'chunks') else []
                 })
         
-        # Отладочный вывод для диагностики
-        all_spans_list = list(doc.spans)
-        if len(entities['PERSON']) == 0:
-            print(f"DEBUG: Natasha не нашел персон. Всего spans: {len(all_spans_list)}")
-            print(f"DEBUG: Типы найденных сущностей: {[s.type for s in all_spans_list[:20]]}")
-            print("DEBUG: Пробую альтернативные методы...")
+        spans = [(span.start, span.stop, span.type) for span in doc.spans]
+        return entities, spans
+    
+    def _extract_natasha_entities_parallel(self, text: str) -> Tuple[Dict[str, List[Dict]], List[Tuple[int, int, str]]]:
+        """
+        То же, что _extract_natasha_entities, но текст делится на части по границам
+        абзацев и обрабатывается в пуле процессов. Смещения приводятся к исходному тексту.
+        """
+        # Пул создается один раз; каждый процесс загружает модели при старте
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context(POOL_START_METHOD),
+                    initializer=_init_worker,
+                )
         
-        # Если Natasha не нашел персон, используем альтернативные методы
-        if len(entities['PERSON']) == 0:
-            # Сначала пробуем через морфологию
-            persons_morph = self._extract_persons_with_morphology(text, doc)
-            entities['PERSON'].extend(persons_morph)
-            
-            # Если и это не помогло, пробуем transformers
-            if len(entities['PERSON']) == 0 and self.use_transformers:
-                persons_transformer = self._extract_persons_with_transformers(text)
-                entities['PERSON'].extend(persons_transformer)
-                print(f"DEBUG: Transformers нашел персон: {len(persons_transformer)}")
+        entities = {
+            'PERSON': [],
+            'LOC': [],
+            'ORG': []
+        }
+        spans = []
         
-        # Дополнительная обработка для нормализации имен
-        entities['PERSON'] = self._normalize_persons(entities['PERSON'])
-        entities['LOC'] = self._normalize_locations(entities['LOC'])
+        chunks = split_on_paragraph_boundaries(text, PARALLEL_CHUNK_SIZE)
+        for chunk_entities, chunk_spans in self._pool.map(_extract_chunk, chunks):
+            for entity_type, entity_list in chunk_entities.items():
+                entities[entity_type].extend(entity_list)
+            spans.extend(chunk_spans)
+        
+        return entities, spans
+    
+    def _extract_entities_with_spacy(self, text: str) -> Dict[str, List[Dict]]:
+        """
+        Извлекает сущности через spaCy, обрабатывая текст пакетами абзацев.
+        Нормализованная форма строится из лемм spaCy.
+        """
+        entities = {
+            'PERSON': [],
+            'LOC': [],
+            'ORG': []
+        }
+        
+        try:
+            nlp = _load_spacy_model(SPACY_MODEL)
+        except Exception as e:
+            print(f"Не удалось загрузить модель spaCy {SPACY_MODEL}: {e}")
+            self.use_spacy = False
+            return entities
+        
+        # Разбиваем на абзацы, запоминая смещение каждого в исходном тексте;
+        # строки длиннее nlp.max_length делятся на части
+        paragraphs = []
+        offsets = []
+        pos = 0
+        for line in text.split('\n'):
+            if line.strip():
+                for piece_offset, piece in _split_long_line(line, nlp.max_length):
+                    paragraphs.append(piece)
+                    offsets.append(pos + piece_offset)
+            pos += len(line) + 1
+        
+        try:
+            # Несколько процессов имеют смысл только для больших текстов. Пул свой,
+            # а не n_process в nlp.pipe: spaCy запускает процессы через fork
+            if self.workers > 1 and len(paragraphs) > SPACY_BATCH_SIZE:
+                with self._pool_lock:
+                    if self._spacy_pool is None:
+                        self._spacy_pool = ProcessPoolExecutor(
+                            max_workers=self.workers,
+                            mp_context=multiprocessing.get_context(POOL_START_METHOD),
+                        )
+                step = max(SPACY_BATCH_SIZE, -(-len(paragraphs) // (self.workers * 4)))
+                batches = [(offsets[i:i + step], paragraphs[i:i + step])
+                           for i in range(0, len(paragraphs), step)]
+                results = list(self._spacy_pool.map(_extract_spacy_batch, batches))
+            else:
+                results = [_extract_spacy_batch((offsets, paragraphs))]
+        except Exception as e:
+            # Пустой результат - extract_entities перейдет к Natasha
+            print(f"Ошибка spaCy при обработке текста: {e}")
+            return entities
+        
+        for batch_entities in results:
+            for entity_type, entity_list in batch_entities.items():
+                entities[entity_type].extend(entity_list)
         
         return entities
     
-    def _extract_persons_with_morphology(self, text: str, doc) -> List[Dict]:
+    def _extract_persons_with_morphology(self, text: str, spans: List[Tuple[int, int, str]]) -> List[Dict]:
         """
         Извлекает персон используя морфологический анализ через pymorphy2.
         Проверяет что слово действительно является именем собственным через морфологические теги.
         """
         persons = []
         
-        # Получаем уже найденные позиции чтобы не дублировать
-        existing_positions = set()
-        for span in doc.spans:
-            if span.type in ['LOC', 'ORG']:
-                existing_positions.add((span.start, span.stop))
-        
-        # Только паттерны где имя четко в контексте действия (более строгие)
-        patterns = [
-            # Имя перед глаголом (субъект действия) - самое надежное
-            r'([А-ЯЁA-Z][а-яёa-z]+(?:\s+[А-ЯЁA-Z][а-яёa-z]+)?)\s+(?:сказал|сказала|думал|думала|работал|работала|жил|жила|был|была|стал|стала|родился|родилась|познакомился|познакомилась|встретил|встретила)',
-            # После глагола (объект) - менее надежно, но проверяем
-            r'(?:сказал|сказала|встретил|встретила|познакомился|познакомилась|знал|знала|любил|любила)\s+([А-ЯЁA-Z][а-яёa-z]+(?:\s+[А-ЯЁA-Z][а-яёa-z]+)?)',
-            # Имя и фамилия вместе перед глаголом
-            r'([А-ЯЁA-Z][а-яёa-z]+\s+[А-ЯЁA-Z][а-яёa-z]+)\s+(?:был|была|стал|стала|жил|жила|работал|работала|родился|родилась)',
-        ]
+        # Получаем уже найденные позиции чтобы не дублировать.
+        # Спаны Natasha не пересекаются, поэтому после сортировки по началу
+        # единственный кандидат на вложение ищется бинарным поиском
+        existing_positions = sorted(
+            (start, stop) for start, stop, span_type in spans if span_type in ('LOC', 'ORG')
+        )
+        existing_starts = [pos[0] for pos in existing_positions]
+        existing_ends = [pos[1] for pos in existing_positions]
         
         found_names = set()  # Для избежания дублей
         
-        for pattern in patterns:
-            for match in re.finditer(pattern, text, re.IGNORECASE):
+        for pattern in self._person_patterns:
+            for match in pattern.finditer(text):
                 name = match.group(1).strip()
                 start, end = match.span(1)
                 
@@ -158,7 +447,8 @@ class EntityExtractor:
                     continue
                 
                 # Проверяем что не попало на уже найденную локацию
-                if any(start >= pos[0] and end <= pos[1] for pos in existing_positions):
+                idx = bisect_right(existing_starts, start) - 1
+                if idx >= 0 and end <= existing_ends[idx]:
                     continue
                 
                 # Строгая проверка через pymorphy2 - должно быть имя собственное
@@ -172,33 +462,14 @@ class EntityExtractor:
                     
                     try:
                         # Парсим слово через морфологию
-                        parsed_list = self.morph.parse(word)
-                        if not parsed_list:
-                            break
-                        
-                        parsed = parsed_list[0]
+                        parsed = self._parse(word)
                         tag = parsed.tag
                         
-                        # Строгая проверка - должно быть имя (Name) или фамилия (Surn)
-                        # или одушевленное существительное в именительном падеже
-                        is_name = False
-                        
                         # Проверяем теги морфологии
                         if hasattr(tag, 'PNCT'):  # Пропускаем знаки препинания
                             break
                         
-                        # Ищем тег Name (имя) или Surn (фамилия) в тегах
-                        tag_str = str(tag)
-                        if 'Name' in tag_str or 'Surn' in tag_str:
-                            is_name = True
-                        elif 'NOUN' in tag_str:
-                            # Может быть одушевленное существительное (имя)
-                            if 'anim' in tag_str and 'nomn' in tag_str:  # одушевленное, именительный
-                                # Дополнительная проверка - не должно быть обычным существительным
-                                # Имена обычно не склоняются как обычные слова
-                                is_name = True
-                        
-                        if is_name:
+                        if _is_name_tag(tag):
                             # Нормализуем
                             norm = parsed.normal_form
                             if norm:
@@ -244,30 +515,15 @@ class EntityExtractor:
         
         try:
             # Ленивая загрузка модели
-            if self.ner_pipeline is None:
-                # Используем легкую модель для русского NER
-                # Можно использовать другие модели, но эта быстрая
-                model_name = "surdan/rubert-base-ner"  # Популярная модель для русского NER
-                try:
-                    self.ner_pipeline = pipeline(
-                        "ner",
-                        model=model_name,
-                        tokenizer=model_name,
-                        aggregation_strategy="simple"
-                    )
-                except Exception as e:
-                    print(f"Не удалось загрузить модель {model_name}: {e}")
-                    print("Пробую альтернативную модель...")
-                    # Альтернатива - используем другую модель или отключаем
-                    self.use_transformers = False
-                    return persons
+            if not self._load_ner_pipeline():
+                return persons
             
             # Разбиваем текст на части если он слишком длинный
             max_length = 512  # Максимальная длина для большинства моделей
             chunks = []
             if len(text) > max_length:
                 # Разбиваем по предложениям
-                sentences = re.split(r'[.!?]\s+', text)
+                sentences = self._sentence_split_re.split(text)
                 current_chunk = ""
                 for sentence in sentences:
                     if len(current_chunk) + len(sentence) < max_length:
@@ -281,23 +537,24 @@ class EntityExtractor:
             else:
                 chunks = [text]
             
-            # Обрабатываем каждый chunk
-            for chunk in chunks:
-                try:
-                    results = self.ner_pipeline(chunk)
-                    for entity in results:
-                        if entity.get('entity_group') == 'PER' or 'PER' in str(entity.get('entity_group', '')):
-                            # Найдена персона
-                            persons.append({
-                                'text': entity['word'],
-                                'start': entity.get('start', 0),
-                                'end': entity.get('end', 0),
-                                'normalized': entity['word'],  # Будет нормализовано позже
-                                'chunks': []
-                            })
-                except Exception as e:
-                    print(f"Ошибка при обработке chunk через transformers: {e}")
-                    continue
+            # Обрабатываем все chunks одним пакетным вызовом pipeline
+            try:
+                batch_results = self.ner_pipeline(chunks, batch_size=NER_BATCH_SIZE)
+            except Exception as e:
+                print(f"Ошибка при обработке chunks через transformers: {e}")
+                return persons
+            
+            for results in batch_results:
+                for entity in results:
+                    if entity.get('entity_group') == 'PER' or 'PER' in str(entity.get('entity_group', '')):
+                        # Найдена персона
+                        persons.append({
+                            'text': entity['word'],
+                            'start': entity.get('start', 0),
+                            'end': entity.get('end', 0),
+                            'normalized': entity['word'],  # Будет нормализовано позже
+                            'chunks': []
+                        })
         
         except Exception as e:
             print(f"Ошибка при использовании transformers для NER: {e}")
@@ -305,6 +562,49 @@ class EntityExtractor:
         
         return persons
     
+    def _load_ner_pipeline(self) -> bool:
+        """
+        Загружает transformers pipeline при первом обращении.
+        Импорт transformers (и torch) выполняется только здесь.
+        
+        Returns:
+            True, если pipeline готов к использованию
+        """
+        if self.ner_pipeline is not None:
+            return True
+        
+        # Используем легкую модель для русского NER
+        # Можно использовать другие модели, но эта быстрая
+        model_name = "surdan/rubert-base-ner"  # Популярная модель для русского NER
+        try:
+            from transformers import pipeline
+            import torch
+            self.ner_pipeline = pipeline(
+                "ner",
+                model=model_name,
+                tokenizer=model_name,
+                aggregation_strategy="simple",
+                device=0 if torch.cuda.is_available() else -1
+            )
+        except Exception as e:
+            print(f"Не удалось загрузить модель {model_name}: {e}")
+            # Отключаем резервный метод, чтобы не пытаться загрузить модель повторно
+            self.use_transformers = False
+            return False
+        
+        return True
+    
+    def _parse(self, word: str):
+        """Возвращает наиболее вероятный разбор слова pymorphy2 с кэшированием."""
+        parsed = self._parse_cache.get(word)
+        if parsed is None:
+            parsed = self.morph.parse(word)[0]
+            # Экземпляр живет весь процесс, поэтому кэш ограничен по размеру
+            if len(self._parse_cache) >= PARSE_CACHE_SIZE:
+                self._parse_cache.clear()
+            self._parse_cache[word] = parsed
+        return parsed
+    
     def _get_normalized_form(self, span, doc) -> str:
         """Получает нормализованную форму (именительный падеж) используя pymorphy2."""
         text = span.text.strip()
@@ -319,7 +619,7 @@ class EntityExtractor:
         for word in words:
             # Пытаемся получить нормальную форму через pymorphy2
             try:
-                parsed = self.morph.parse(word)[0]
+                parsed = self._parse(word)
                 normal_form = parsed.normal_form
                 # Сохраняем заглавную букву если была в оригинале
                 if word and word[0].isupper():
@@ -334,7 +634,8 @@ class EntityExtractor:
     def _normalize_persons(self, persons: List[Dict]) -> List[Dict]:
         """Нормализует имена персон (убирает дубликаты с похожими именами)."""
         # Группируем персон по нормализованному имени
-        person_groups = {}
+        groups = defaultdict(list)
+        name_of = {}  # Имя группы в именительном падеже (первое встреченное написание)
         
         for person in persons:
             normalized_name = person.get('normalized', person['text'].strip())
@@ -346,24 +647,17 @@ class EntityExtractor:
                 key = parts[0] if parts else normalized_name
             
             key_lower = key.lower()
-            
-            # Группируем: используем наиболее частое написание
-            if key_lower not in person_groups:
-                person_groups[key_lower] = {
-                    'name': key,  # Имя в именительном падеже
-                    'persons': []
-                }
-            
-            person_groups[key_lower]['persons'].append(person)
+            groups[key_lower].append(person)
+            name_of.setdefault(key_lower, key)
         
         # Возвращаем уникальные персоны с нормализованным именем
         normalized = []
-        for key_lower, group in person_groups.items():
+        for key_lower, group in groups.items():
             # Берем первого персонажа из группы
-            person = group['persons'][0].copy()
-            person['normalized'] = group['name']
+            person = group[0].copy()
+            person['normalized'] = name_of[key_lower]
             # Обновляем количество упоминаний
-            person['mentions_count'] = len(group['persons'])
+            person['mentions_count'] = len(group)
             normalized.append(person)
         
         return normalized
@@ -371,32 +665,26 @@ class EntityExtractor:
     def _normalize_locations(self, locations: List[Dict]) -> List[Dict]:
         """Нормализует названия локаций, объединяя разные падежи в одно имя."""
         # Группируем локации по базовому названию
-        loc_groups = {}
+        groups = defaultdict(list)
+        name_of = {}  # Название группы в именительном падеже
         
         for loc in locations:
             name = loc.get('normalized', loc['text'].strip())
-            original = loc['text'].strip()
             
             # Пытаемся получить базовую форму (именительный падеж)
             base_name = self._get_location_base_form(name)
             base_key = base_name.lower()
-            
-            if base_key not in loc_groups:
-                loc_groups[base_key] = {
-                    'name': base_name,  # Именительный падеж
-                    'locations': []
-                }
-            
-            loc_groups[base_key]['locations'].append(loc)
+            groups[base_key].append(loc)
+            name_of.setdefault(base_key, base_name)
         
         # Возвращаем уникальные локации с нормализованным именем
         normalized = []
-        for base_key, group in loc_groups.items():
+        for base_key, group in groups.items():
             # Берем первую локацию из группы
-            loc = group['locations'][0].copy()
-            loc['normalized'] = group['name']
+            loc = group[0].copy()
+            loc['normalized'] = name_of[base_key]
             # Обновляем количество упоминаний
-            loc['mentions_count'] = len(group['locations'])
+            loc['mentions_count'] = len(group)
             normalized.append(loc)
         
         return normalized
@@ -409,14 +697,14 @@ class EntityExtractor:
         
         # Используем pymorphy2 для нормализации
         # Разбиваем на слова (для составных названий типа "Санкт-Петербург")
-        words = re.split(r'[\s-]+', name)
+        words = self._word_split_re.split(name)
         normalized_words = []
         
         for word in words:
             if not word:
                 continue
             # Получаем нормальную форму (именительный падеж, единственное число)
-            parsed = self.morph.parse(word)[0]
+            parsed = self._parse(word)
             normal_form = parsed.normal_form
             # Сохраняем заглавную букву если была
             if word and word[0].isupper():
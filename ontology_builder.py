@@ -4,8 +4,61 @@
 Поддерживает экспорт в OWL формат для открытия в Protege.
 """
 from typing import Dict, List, Set
-from collections import defaultdict
+from collections import Counter, defaultdict
+from functools import lru_cache
+from itertools import chain
 import re
+import sys
+
+# Шаблоны очистки имен для OWL (компилируются один раз)
+_NON_ALNUM_RE = re.compile(r'[^a-zA-Zа-яА-ЯёЁ0-9_]')
+_UNDERSCORES_RE = re.compile(r'_+')
+
+
+class Relation:
+    """
+    Связь между двумя сущностями онтологии.
+    Хранится в __slots__ вместо словаря, что в разы экономит память на больших
+    списках связей. Доступ по ключу (relation['source'], relation.get(...))
+    сохранен для кода, работающего со связями как со словарями.
+    """
+    __slots__ = ('source', 'target', 'type', 'confidence', 'context')
+    
+    def __init__(self, source: str, target: str, type: str,
+                 confidence: float = 0.5, context: str = ''):
+        self.source = source
+        self.target = target
+        self.type = type
+        self.confidence = confidence
+        self.context = context
+    
+    def __getitem__(self, key: str):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+    
+    def get(self, key: str, default=None):
+        return getattr(self, key, default)
+    
+    def __eq__(self, other):
+        if not isinstance(other, Relation):
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+    
+    def __repr__(self):
+        return (f"Relation(source={self.source!r}, target={self.target!r}, "
+                f"type={self.type!r}, confidence={self.confidence!r})")
+    
+    def to_dict(self) -> Dict:
+        """Возвращает связь в виде словаря (для JSON сериализации)."""
+        return {
+            'source': self.source,
+            'target': self.target,
+            'type': self.type,
+            'confidence': self.confidence,
+            'context': self.context
+        }
 
 
 class OntologyBuilder:
@@ -15,9 +68,10 @@ class OntologyBuilder:
         """Инициализация онтологии."""
         self.ontology = {
             'entities': {},  # {name: {type: 'PERSON'|'LOC'|'ORG', attributes: {...}}}
-            'relations': [],  # [{source, target, type, ...}]
-            'relation_types': set()
+            'relations': []  # [Relation(source, target, type, ...)]
         }
+        # Статистика вычисляется один раз в конце build_ontology
+        self._stats = None
     
     def build_ontology(self, entities: Dict[str, List[Dict]], relations: List[Dict]) -> Dict:
         """
@@ -30,26 +84,48 @@ class OntologyBuilder:
         Returns:
             Онтология в виде словаря
         """
-        # Добавляем сущности
-        for entity_type, entity_list in entities.items():
-            for entity in entity_list:
-                name = entity['normalized']
-                if name not in self.ontology['entities']:
-                    self.ontology['entities'][name] = {
-                        'type': entity_type,
-                        'attributes': {
-                            'mentions': 1,
-                            'first_mention': entity.get('start', 0)
-                        }
+        # Добавляем сущности: упоминания считаются через Counter, затем
+        # каждое уникальное имя добавляется один раз по первому вхождению.
+        # Имена и типы интернируются: одни и те же строки повторяются в ключах
+        # словарей и во всех связях, и хранятся в памяти один раз
+        ontology_entities = self.ontology['entities']
+        names = [
+            (sys.intern(entity['normalized']), entity_type, entity.get('start', 0))
+            for entity_type, entity_list in entities.items()
+            for entity in entity_list
+        ]
+        mentions = Counter(name for name, _, _ in names)
+        seen = set()
+        for name, entity_type, start in names:
+            if name in seen:
+                continue
+            seen.add(name)
+            if name in ontology_entities:
+                ontology_entities[name]['attributes']['mentions'] += mentions[name]
+            else:
+                ontology_entities[name] = {
+                    'type': entity_type,
+                    'attributes': {
+                        'mentions': mentions[name],
+                        'first_mention': start
                     }
-                else:
-                    self.ontology['entities'][name]['attributes']['mentions'] += 1
+                }
         
-        # Добавляем связи
+        # Добавляем связи. Повторы (source, target, type) не дублируются:
+        # остается одна связь с наибольшей уверенностью и ее контекстом
+        relation_index = {(r.source, r.target, r.type): r for r in self.ontology['relations']}
         for relation in relations:
-            source = relation['source']
-            target = relation['target']
-            rel_type = relation['type']
+            source = sys.intern(relation['source'])
+            target = sys.intern(relation['target'])
+            rel_type = sys.intern(relation['type'])
+            confidence = relation.get('confidence', 0.5)
+            
+            existing = relation_index.get((source, target, rel_type))
+            if existing is not None:
+                if confidence > existing.confidence:
+                    existing.confidence = confidence
+                    existing.context = relation.get('context', '')
+                continue
             
             # Убеждаемся, что обе сущности есть в онтологии
             if source not in self.ontology['entities']:
@@ -65,188 +141,84 @@ class OntologyBuilder:
                 }
             
             # Добавляем связь
-            self.ontology['relations'].append({
-                'source': source,
-                'target': target,
-                'type': rel_type,
-                'confidence': relation.get('confidence', 0.5),
-                'context': relation.get('context', '')
-            })
-            
-            self.ontology['relation_types'].add(rel_type)
+            new_relation = Relation(
+                source,
+                target,
+                rel_type,
+                confidence,
+                relation.get('context', '')
+            )
+            relation_index[(source, target, rel_type)] = new_relation
+            self.ontology['relations'].append(new_relation)
         
         # Вычисляем дополнительные атрибуты для сущностей
         self._enrich_entities()
         
+        # После построения онтология не меняется, поэтому статистику можно посчитать сразу
+        self._stats = self._compute_statistics()
+        
         return self.ontology
     
     def _enrich_entities(self):
         """Обогащает сущности дополнительными атрибутами на основе связей."""
-        # Считаем количество связей для каждой сущности
-        relation_count = defaultdict(int)
-        relation_types_count = defaultdict(lambda: defaultdict(int))
+        relations = self.ontology['relations']
         
-        for relation in self.ontology['relations']:
-            source = relation['source']
-            target = relation['target']
-            rel_type = relation['type']
-            
-            relation_count[source] += 1
-            relation_count[target] += 1
-            relation_types_count[source][rel_type] += 1
-            relation_types_count[target][rel_type] += 1
+        # Связи считаются одним плоским Counter по парам (сущность, тип):
+        # Counter.update работает на уровне C, а пары подаются в порядке обхода,
+        # чтобы сохранить порядок типов. Общее число связей сущности получается
+        # при развороте в словари по сущностям, без второго прохода по связям
+        typed_count = Counter(chain.from_iterable(
+            ((r.source, r.type), (r.target, r.type)) for r in relations
+        ))
+        
+        relation_count = defaultdict(int)
+        relation_types_count = defaultdict(dict)
+        for (entity_name, rel_type), count in typed_count.items():
+            relation_types_count[entity_name][rel_type] = count
+            relation_count[entity_name] += count
         
         # Добавляем статистику в атрибуты
         for entity_name, entity_data in self.ontology['entities'].items():
-            entity_data['attributes']['total_relations'] = relation_count[entity_name]
-            entity_data['attributes']['relation_types'] = dict(relation_types_count[entity_name])
+            attrs = entity_data['attributes']
+            attrs['total_relations'] = relation_count.get(entity_name, 0)
+            attrs['relation_types'] = relation_types_count.get(entity_name, {})
     
     def get_statistics(self) -> Dict:
         """Возвращает статистику по онтологии."""
+        if self._stats is None:
+            self._stats = self._compute_statistics()
+        return dict(self._stats)
+    
+    def _compute_statistics(self) -> Dict:
+        """Вычисляет статистику по онтологии."""
+        # По одному проходу по сущностям и по связям независимо от числа типов
+        entity_type_counts = Counter(e['type'] for e in self.ontology['entities'].values())
+        rel_type_counts = Counter(r.type for r in self.ontology['relations'])
         return {
             'total_entities': len(self.ontology['entities']),
             'total_relations': len(self.ontology['relations']),
             'entity_types': {
-                entity_type: sum(1 for e in self.ontology['entities'].values() if e['type'] == entity_type)
-                for entity_type in ['PERSON', 'LOC', 'ORG']
+                entity_type: entity_type_counts.get(entity_type, 0)
+                for entity_type in ('PERSON', 'LOC', 'ORG')
             },
-            'relation_types': {
-                rel_type: sum(1 for r in self.ontology['relations'] if r['type'] == rel_type)
-                for rel_type in self.ontology['relation_types']
-            }
+            'relation_types': dict(rel_type_counts)
         }
     
     def export_to_owl(self, output_file: str, ontology_name: str = "BookConnections"):
         """
         Экспортирует онтологию в OWL формат для открытия в Protege.
+        Код экспорта вынесен в ontology_builder_owl и загружается только при вызове.
         
         Args:
             output_file: Путь к выходному OWL файлу
             ontology_name: Имя онтологии
         """
-        try:
-            from owlready2 import (get_ontology, Thing, ObjectProperty, DatatypeProperty,
-                                 FunctionalProperty, SymmetricProperty)
-        except ImportError:
-            raise ImportError("Для экспорта в OWL требуется библиотека owlready2. Установите: pip install owlready2")
-        
-        # Создаем новую онтологию
-        iri = f"http://example.org/{ontology_name}.owl#"
-        onto = get_ontology(iri)
-        
-        # Создаем базовые классы для типов сущностей
-        with onto:
-            class Person(Thing):
-                pass
-            
-            class Location(Thing):
-                pass
-            
-            class Organization(Thing):
-                pass
-            
-            # Создаем объектные свойства для типов связей
-            # Используем синтаксис Person >> Location для domain и range
-            class hasResidence(ObjectProperty, FunctionalProperty):
-                domain = [Person]
-                range = [Location]
-            
-            class hasResident(ObjectProperty):
-                domain = [Location]
-                range = [Person]
-            
-            class hasFamilyRelation(ObjectProperty):
-                domain = [Person]
-                range = [Person]
-            
-            class hasFriendship(ObjectProperty, SymmetricProperty):
-                domain = [Person]
-                range = [Person]
-            
-            class hasWorkRelation(ObjectProperty):
-                domain = [Person]
-                range = [Person]
-            
-            class hasLoveRelation(ObjectProperty):
-                domain = [Person]
-                range = [Person]
-            
-            # Создаем свойства данных
-            class mentions(DatatypeProperty):
-                domain = [Thing]
-                range = [int]
-            
-            class confidence(DatatypeProperty):
-                domain = [ObjectProperty]
-                range = [float]
-        
-        # Маппинг типов связей на OWL свойства
-        relation_to_property = {
-            'RESIDENCE': hasResidence,
-            'HAS_RESIDENT': hasResident,
-            'FAMILY': hasFamilyRelation,
-            'FRIENDSHIP': hasFriendship,
-            'WORK': hasWorkRelation,
-            'LOVE': hasLoveRelation
-        }
-        
-        # Маппинг типов сущностей на OWL классы
-        entity_type_to_class = {
-            'PERSON': Person,
-            'LOC': Location,
-            'ORG': Organization
-        }
-        
-        # Создаем индивиды (экземпляры) для всех сущностей
-        entity_instances = {}
-        for entity_name, entity_data in self.ontology['entities'].items():
-            entity_type = entity_data['type']
-            owl_class = entity_type_to_class.get(entity_type, Thing)
-            
-            # Очищаем имя для OWL (убираем недопустимые символы)
-            clean_name = self._clean_owl_name(entity_name)
-            instance = owl_class(clean_name)
-            
-            # Добавляем аннотацию с оригинальным именем
-            instance.label = [entity_name]
-            
-            # Добавляем количество упоминаний
-            mentions_count = entity_data['attributes'].get('mentions', 0)
-            if mentions_count > 0:
-                instance.mentions = [mentions_count]
-            
-            entity_instances[entity_name] = instance
-        
-        # Создаем связи между индивидами
-        for relation in self.ontology['relations']:
-            source = relation['source']
-            target = relation['target']
-            rel_type = relation['type']
-            confidence_val = relation.get('confidence', 0.5)
-            
-            if source not in entity_instances or target not in entity_instances:
-                continue
-            
-            source_instance = entity_instances[source]
-            target_instance = entity_instances[target]
-            property_obj = relation_to_property.get(rel_type)
-            
-            if property_obj:
-                try:
-                    # Добавляем связь (в owlready2 используется синтаксис instance.property.append(value))
-                    getattr(source_instance, property_obj.name).append(target_instance)
-                except Exception as e:
-                    # Если не удалось добавить связь, пропускаем
-                    print(f"Не удалось добавить связь {source} -> {target}: {e}")
-                    continue
-        
-        # Сохраняем онтологию в файл
-        onto.save(file=output_file, format="rdfxml")
-        print(f"Онтология сохранена в OWL формате: {output_file}")
-        
-        return output_file
+        from ontology_builder_owl import export_to_owl
+        return export_to_owl(self, output_file, ontology_name)
     
-    def _clean_owl_name(self, name: str) -> str:
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _clean_owl_name(name: str) -> str:
         """
         Очищает имя для использования в OWL.
         Убирает недопустимые символы и заменяет пробелы.
@@ -254,9 +226,9 @@ class OntologyBuilder:
         # Заменяем пробелы на подчеркивания
         clean = name.replace(' ', '_')
         # Убираем недопустимые символы (оставляем только буквы, цифры, подчеркивания)
-        clean = re.sub(r'[^a-zA-Zа-яА-ЯёЁ0-9_]', '_', clean)
+        clean = _NON_ALNUM_RE.sub('_', clean)
         # Убираем множественные подчеркивания
-        clean = re.sub(r'_+', '_', clean)
+        clean = _UNDERSCORES_RE.sub('_', clean)
         # Убираем подчеркивания в начале и конце
         clean = clean.strip('_')
         # Если имя начинается с цифры, добавляем префикс
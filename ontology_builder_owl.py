@@ -0,0 +1,174 @@
+"""
+Экспорт онтологии в OWL формат для открытия в Protege.
+Модуль загружается только при экспорте, поэтому owlready2 и построение
+OWL-схемы не замедляют импорт ontology_builder.
+"""
+from collections import defaultdict
+from functools import lru_cache
+import threading
+
+# Экспорты выполняются по одному: онтология с данным именем кэшируется и общая
+# для всех вызовов (каждый экспорт сначала удаляет ее индивидов), а все
+# онтологии owlready2 хранятся в одном общем мире (default_world)
+_export_lock = threading.Lock()
+
+
+@lru_cache(maxsize=8)
+def _get_owl_schema(ontology_name: str):
+    """
+    Создает OWL-схему (классы и свойства) для онтологии с заданным именем.
+    Результат кэшируется, поэтому повторный экспорт не строит схему заново.
+    
+    Args:
+        ontology_name: Имя онтологии
+        
+    Returns:
+        Кортеж (онтология, {тип связи: свойство}, {тип сущности: класс})
+    """
+    try:
+        from owlready2 import (get_ontology, Thing, ObjectProperty, DatatypeProperty,
+                             FunctionalProperty, SymmetricProperty)
+    except ImportError:
+        raise ImportError("Для экспорта в OWL требуется библиотека owlready2. Установите: pip install owlready2")
+    
+    # Создаем онтологию
+    iri = f"http://example.org/{ontology_name}.owl#"
+    onto = get_ontology(iri)
+    
+    # Создаем базовые классы для типов сущностей
+    with onto:
+        class Person(Thing):
+            pass
+        
+        class Location(Thing):
+            pass
+        
+        class Organization(Thing):
+            pass
+        
+        # Создаем объектные свойства для типов связей
+        # Используем синтаксис Person >> Location для domain и range
+        class hasResidence(ObjectProperty, FunctionalProperty):
+            domain = [Person]
+            range = [Location]
+        
+        class hasResident(ObjectProperty):
+            domain = [Location]
+            range = [Person]
+        
+        class hasFamilyRelation(ObjectProperty):
+            domain = [Person]
+            range = [Person]
+        
+        class hasFriendship(ObjectProperty, SymmetricProperty):
+            domain = [Person]
+            range = [Person]
+        
+        class hasWorkRelation(ObjectProperty):
+            domain = [Person]
+            range = [Person]
+        
+        class hasLoveRelation(ObjectProperty):
+            domain = [Person]
+            range = [Person]
+        
+        # Создаем свойства данных
+        class mentions(DatatypeProperty):
+            domain = [Thing]
+            range = [int]
+        
+        class confidence(DatatypeProperty):
+            domain = [ObjectProperty]
+            range = [float]
+    
+    # Маппинг типов связей на OWL свойства
+    relation_to_property = {
+        'RESIDENCE': hasResidence,
+        'HAS_RESIDENT': hasResident,
+        'FAMILY': hasFamilyRelation,
+        'FRIENDSHIP': hasFriendship,
+        'WORK': hasWorkRelation,
+        'LOVE': hasLoveRelation
+    }
+    
+    # Маппинг типов сущностей на OWL классы
+    entity_type_to_class = {
+        'PERSON': Person,
+        'LOC': Location,
+        'ORG': Organization
+    }
+    
+    return onto, relation_to_property, entity_type_to_class
+
+
+def export_to_owl(builder, output_file: str, ontology_name: str = "BookConnections"):
+    """
+    Экспортирует онтологию построителя в OWL формат.
+    Одновременные вызовы из разных потоков выполняются по очереди.
+    
+    Args:
+        builder: OntologyBuilder с построенной онтологией
+        output_file: Путь к выходному OWL файлу
+        ontology_name: Имя онтологии
+        
+    Returns:
+        Путь к сохраненному файлу
+    """
+    with _export_lock:
+        return _export_to_owl(builder, output_file, ontology_name)
+
+
+def _export_to_owl(builder, output_file: str, ontology_name: str):
+    """Экспорт в OWL; вызывается только под _export_lock (см. export_to_owl)."""
+    onto, relation_to_property, entity_type_to_class = _get_owl_schema(ontology_name)
+    from owlready2 import Thing, destroy_entity
+    
+    # Индивиды предыдущего экспорта в кэшированной онтологии удаляются
+    for individual in list(onto.individuals()):
+        destroy_entity(individual)
+    
+    # Создаем индивиды (экземпляры) для всех сущностей
+    entity_instances = {}
+    for entity_name, entity_data in builder.ontology['entities'].items():
+        entity_type = entity_data['type']
+        owl_class = entity_type_to_class.get(entity_type, Thing)
+    
+        # Очищаем имя для OWL (убираем недопустимые символы)
+        clean_name = builder._clean_owl_name(entity_name)
+        instance = owl_class(clean_name)
+    
+        # Добавляем аннотацию с оригинальным именем
+        instance.label = [entity_name]
+    
+        # Добавляем количество упоминаний
+        mentions_count = entity_data['attributes'].get('mentions', 0)
+        if mentions_count > 0:
+            instance.mentions = [mentions_count]
+    
+        entity_instances[entity_name] = instance
+    
+    # Создаем связи между индивидами: связи без известных сущностей или
+    # без OWL-свойства отбрасываются заранее, остальные группируются по
+    # (источник, свойство), чтобы добавлять цели одним extend на группу
+    targets_by_property = defaultdict(list)
+    for relation in builder.ontology['relations']:
+        property_obj = relation_to_property.get(relation.type)
+        if (property_obj is not None and relation.source in entity_instances
+                and relation.target in entity_instances):
+            targets_by_property[(relation.source, property_obj)].append(relation.target)
+    
+    for (source, property_obj), targets in targets_by_property.items():
+        try:
+            # Добавляем связи (в owlready2 значения свойства хранятся в списке instance.property)
+            getattr(entity_instances[source], property_obj.name).extend(
+                [entity_instances[target] for target in targets]
+            )
+        except Exception as e:
+            # Если не удалось добавить связи, пропускаем
+            print(f"Не удалось добавить связь {source} -> {', '.join(targets)}: {e}")
+    
+    # Сохраняем онтологию в файл
+    onto.save(file=output_file, format="rdfxml")
+    print(f"Онтология сохранена в OWL формате: {output_file}")
+    
+    return output_file
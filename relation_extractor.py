@@ -3,8 +3,108 @@
 Определяет тип связи между персонами и локациями.
 """
 from typing import List, Dict, Tuple, Set
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import chain
+from types import SimpleNamespace
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import threading
+import os
 import re
 
+try:
+    from pymorphy2 import MorphAnalyzer
+except ImportError:
+    MorphAnalyzer = None
+
+# Косвенные падежи, в которых ищутся названия локаций (pymorphy2)
+LOC_CASES = ('gent', 'datv', 'accs', 'ablt', 'loct')
+# Максимальное число локаций в кэше падежных форм
+LOC_FORMS_CACHE_SIZE = 10_000
+# Число вариантов написания сущностей, начиная с которого упоминания ищутся
+# одним проходом регулярного выражения, а не отдельным поиском каждого варианта
+MENTION_SCANNER_MIN_VARIANTS = 120
+# Сколько первых упоминаний каждого варианта нужно методам поиска связей
+# (наибольшее из ограничений: 30 упоминаний первой персоны в паре)
+MAX_MENTION_POSITIONS = 30
+
+# Число процессов для извлечения связей из длинных текстов (1 - без параллелизма).
+# По умолчанию выключено: ограничения на число упоминаний (MAX_MENTION_POSITIONS)
+# действуют в каждой части отдельно, поэтому параллельный результат может
+# содержать больше связей, чем последовательный
+RELATION_WORKERS = int(os.environ.get('RELATION_WORKERS', 1))
+# Способ запуска процессов пула: fork многопоточного процесса (Flask, gunicorn
+# --threads) может унаследовать захваченные другими потоками блокировки
+POOL_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+# Размер части текста (в символах) для параллельной обработки
+RELATION_CHUNK_SIZE = 200_000
+# Перекрытие соседних частей: наибольшее окно между упоминаниями в связи
+RELATION_CHUNK_OVERLAP = 600
+
+
+def _trie_alternation(words) -> str:
+    """
+    Строит регулярное выражение, совпадающее с любым из слов, в виде
+    префиксного дерева: общий префикс проверяется один раз, и в каждой
+    позиции движок выбирает ветку по очередному символу, а не перебирает
+    все слова подряд. Из подходящих слов выбирается самое длинное.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}  # Конец слова
+    return _trie_node_pattern(trie)
+
+
+def _trie_node_pattern(node: Dict[str, Dict]) -> str:
+    """Рекурсивно переводит узел префиксного дерева в регулярное выражение."""
+    branches = [re.escape(char) + _trie_node_pattern(child)
+                for char, child in sorted(node.items()) if char]
+    if not branches:
+        return ''
+    pattern = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+    if '' in node:
+        # Слово может закончиться здесь; жадный квантификатор сначала пробует более длинное
+        pattern = '(?:' + pattern + ')?'
+    return pattern
+
+
+def _keyword_pattern(keywords: List[str]) -> 're.Pattern':
+    """
+    Компилирует список ключевых слов в одно регулярное выражение.
+    Слова ищутся с начала слова текста; длинные допускают окончание
+    ('родственник' -> 'родственниками'), а короткие предлоги ('в', 'из')
+    должны совпадать со словом целиком. Слова собраны в префиксное дерево
+    (см. _trie_alternation), и из подходящих выбирается самое длинное.
+    """
+    stems = _trie_alternation({keyword for keyword in keywords if len(keyword) > 2})
+    words = _trie_alternation({keyword for keyword in keywords if len(keyword) <= 2})
+    alternatives = []
+    if stems:
+        alternatives.append(r'\b(?:' + stems + r')')
+    if words:
+        alternatives.append(r'\b(?:' + words + r')\b')
+    return re.compile('|'.join(alternatives), re.IGNORECASE)
+
+
+# Экземпляр RelationExtractor внутри процесса пула
+_worker_extractor = None
+
+
+def _init_worker():
+    """Создает экстрактор один раз при старте процесса пула."""
+    global _worker_extractor
+    _worker_extractor = RelationExtractor()
+
+
+def _extract_chunk(chunk: Tuple[str, Dict[str, List[Dict]], Dict[str, List[Dict]]]) -> List[Dict]:
+    """Извлекает связи из части текста в процессе пула (без обратных связей)."""
+    text, entities, span_entities = chunk
+    return _worker_extractor._extract_core(text, entities, span_entities)
+
 
 class RelationExtractor:
     """Класс для извлечения связей между сущностями."""
@@ -38,9 +138,47 @@ class RelationExtractor:
         'love', 'loves', 'married', 'wife', 'husband', 'in love'
     ]
     
+    # Ключевые слова каждого типа скомпилированы один раз при импорте модуля
+    RESIDENCE_RE = _keyword_pattern(RESIDENCE_KEYWORDS)
+    FAMILY_RE = _keyword_pattern(FAMILY_KEYWORDS)
+    FRIENDSHIP_RE = _keyword_pattern(FRIENDSHIP_KEYWORDS)
+    WORK_RE = _keyword_pattern(WORK_KEYWORDS)
+    LOVE_RE = _keyword_pattern(LOVE_KEYWORDS)
+    
+    KEYWORD_PATTERNS = {
+        'RESIDENCE': RESIDENCE_RE,
+        'FAMILY': FAMILY_RE,
+        'FRIENDSHIP': FRIENDSHIP_RE,
+        'WORK': WORK_RE,
+        'LOVE': LOVE_RE,
+    }
+    
+    # Типы обратных связей
+    _BIDI_MAP = {
+        'RESIDENCE': 'HAS_RESIDENT',
+        'FAMILY': 'FAMILY',
+        'FRIENDSHIP': 'FRIENDSHIP',
+        'WORK': 'WORK',
+        'LOVE': 'LOVE'
+    }
+    # Симметричные связи уже двусторонние, обратные для них не создаются
+    _SYMMETRIC = frozenset({'FAMILY', 'FRIENDSHIP', 'LOVE'})
+    
+    # Типы связей между персонами (ключевые слова ищутся по индексу)
+    _PERSON_RELATION_TYPES = ('FAMILY', 'FRIENDSHIP', 'WORK', 'LOVE')
+    # Падежные окончания для локаций, если pymorphy2 не установлен
+    _LOC_CASE_ENDINGS = ('а', 'е', 'и', 'у', 'ом', 'ой', 'ами')
+    
     def __init__(self):
-        """Инициализация ключевых слов."""
-        pass
+        """Инициализация морфологического анализатора для падежей локаций."""
+        # Без pymorphy2 падежные формы строятся подстановкой окончаний
+        self.morph = MorphAnalyzer() if MorphAnalyzer is not None else None
+        # Кэш падежных форм: одни и те же локации встречаются во всех фрагментах
+        self._loc_forms_cache = {}
+        # Пул процессов для длинных текстов создается при первой надобности;
+        # экземпляр общий для потоков веб-приложения, поэтому под блокировкой
+        self._pool = None
+        self._pool_lock = threading.Lock()
     
     def extract_relations(self, text: str, entities: Dict[str, List[Dict]]) -> List[Dict]:
         """
@@ -67,24 +205,205 @@ class RelationExtractor:
                 'context': 'Иван из Саратова'
             }, ...]
         """
+        # Длинные тексты обрабатываются по частям в нескольких процессах
+        if RELATION_WORKERS > 1 and len(text) > 2 * RELATION_CHUNK_SIZE:
+            relations = self._extract_core_parallel(text, entities)
+        else:
+            relations = self._extract_core(text, entities)
+        
+        # Создаем обратные связи для всех найденных отношений
+        relations = self._create_bidirectional_relations(relations)
+        
+        return relations
+    
+    def _extract_core(self, text: str, entities: Dict[str, List[Dict]],
+                      span_entities: Dict[str, List[Dict]] = None) -> List[Dict]:
+        """
+        Извлекает прямые связи (персона-локация и персона-персона) без
+        обратных связей.
+        
+        Args:
+            text: Исходный текст или его часть
+            entities: Сущности, позиции которых отсчитываются от начала text
+            span_entities: Сущности, упоминания которых лежат внутри text; по
+                ним ищутся связи рядом с позицией сущности (по умолчанию entities)
+            
+        Returns:
+            Список связей без дублей
+        """
         relations = []
         
+        # Позиции ключевых слов находятся одним проходом по тексту для каждого
+        # типа связи; дальше окна контекста проверяются по индексу
+        keyword_hits = self._index_keywords(text)
+        # Текст в нижнем регистре строится один раз для поиска упоминаний
+        text_lower = text.lower()
+        # Сущности в виде столбцов: имена и их варианты готовятся один раз
+        persons = self._to_soa(entities.get('PERSON', []))
+        locations = self._to_soa(entities.get('LOC', []))
+        span_persons = persons if span_entities is None else self._to_soa(span_entities.get('PERSON', []))
+        # Позиции упоминаний ищутся один раз для каждого варианта написания
+        mention_positions = self._index_mentions(text_lower, persons, locations)
+        
         # Извлечение связей персона-локация (место жительства)
-        person_loc_rels = self._extract_person_location_relations(text, entities)
+        person_loc_rels = self._extract_person_location_relations(text, text_lower, persons, locations,
+                                                                   keyword_hits, mention_positions,
+                                                                   span_persons)
         relations.extend(person_loc_rels)
         
         # Извлечение связей персона-персона
-        person_person_rels = self._extract_person_person_relations(text, entities)
+        person_person_rels = self._extract_person_person_relations(text, text_lower, persons,
+                                                                   keyword_hits, mention_positions)
         relations.extend(person_person_rels)
         
-        # Если не нашли связей через паттерны, пробуем более простой метод
-        if len(relations) == 0 and len(entities.get('PERSON', [])) >= 2:
-            relations.extend(self._extract_simple_relations(text, entities))
+        return relations
+    
+    def _extract_core_parallel(self, text: str, entities: Dict[str, List[Dict]]) -> List[Dict]:
+        """
+        То же, что _extract_core, но текст делится на перекрывающиеся части,
+        которые обрабатываются в пуле процессов. Каждая часть получает все
+        сущности (с позициями относительно начала части): после нормализации
+        у сущности остается только первое упоминание, а в тексте части ее
+        находят по вариантам написания. Поиск рядом с позицией сущности
+        (метод 1 персона-локация) ограничен сущностями, лежащими в части.
+        Связи из разных частей объединяются без дублей.
+        """
+        # Пул создается один раз на экземпляр
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=RELATION_WORKERS,
+                    mp_context=multiprocessing.get_context(POOL_START_METHOD),
+                    initializer=_init_worker,
+                )
         
-        # Создаем обратные связи для всех найденных отношений
-        relations = self._create_bidirectional_relations(relations)
+        chunks = []
+        for chunk_start in range(0, len(text), RELATION_CHUNK_SIZE):
+            chunk_end = min(len(text), chunk_start + RELATION_CHUNK_SIZE + RELATION_CHUNK_OVERLAP)
+            chunk_entities = {
+                entity_type: [
+                    dict(entity, start=entity['start'] - chunk_start, end=entity['end'] - chunk_start)
+                    for entity in entity_list
+                ]
+                for entity_type, entity_list in entities.items()
+            }
+            span_entities = {
+                entity_type: [
+                    entity for entity in entity_list
+                    if entity['start'] >= 0 and entity['end'] <= chunk_end - chunk_start
+                ]
+                for entity_type, entity_list in chunk_entities.items()
+            }
+            chunks.append((text[chunk_start:chunk_end], chunk_entities, span_entities))
+            if chunk_end == len(text):
+                break
         
-        return relations
+        # Связь из перекрытия находится в обеих частях
+        relations = {}
+        for chunk_relations in self._pool.map(_extract_chunk, chunks):
+            for relation in chunk_relations:
+                self._keep_best(relations, relation)
+        
+        return list(relations.values())
+    
+    def _index_keywords(self, text: str) -> Dict[str, Tuple[array, array]]:
+        """
+        Находит все вхождения ключевых слов в тексте, по одному проходу
+        скомпилированного шаблона на каждый тип связи.
+        
+        Args:
+            text: Исходный текст
+            
+        Returns:
+            Словарь {тип связи: (начала вхождений, концы вхождений)}, по возрастанию
+        """
+        keyword_hits = {}
+        for relation_type, pattern in self.KEYWORD_PATTERNS.items():
+            starts, ends = array('q'), array('q')
+            for match in pattern.finditer(text):
+                starts.append(match.start())
+                ends.append(match.end())
+            keyword_hits[relation_type] = (starts, ends)
+        return keyword_hits
+    
+    def _index_mentions(self, text_lower: str, persons: SimpleNamespace,
+                        locations: SimpleNamespace) -> Dict[str, array]:
+        """
+        Находит позиции всех вариантов написания персон и локаций.
+        Каждый уникальный вариант ищется в тексте ровно один раз; если
+        вариантов много, все они ищутся одним проходом (см. _scan_mentions).
+        Для каждого варианта сохраняются только первые MAX_MENTION_POSITIONS
+        позиций: методы берут не больше стольких первых упоминаний.
+        
+        Args:
+            text_lower: Текст в нижнем регистре
+            persons: Персоны в виде столбцов (см. _to_soa)
+            locations: Локации в виде столбцов
+            
+        Returns:
+            Словарь {вариант в нижнем регистре: позиции вхождений}
+        """
+        variants = set(chain.from_iterable(persons.variants_lower))
+        variants.update(locations.names_lower)
+        variants.update(locations.texts_lower)
+        variants.discard('')
+        if len(variants) >= MENTION_SCANNER_MIN_VARIANTS:
+            return self._scan_mentions(text_lower, variants, MAX_MENTION_POSITIONS)
+        return {variant: self._find_all_positions(text_lower, variant, MAX_MENTION_POSITIONS)
+                for variant in variants}
+    
+    @staticmethod
+    def _scan_mentions(text_lower: str, variants: Set[str], max_hits: int = None) -> Dict[str, array]:
+        """
+        Находит позиции всех вариантов одним проходом регулярного выражения,
+        построенного по сущностям этого текста.
+        
+        Просмотр вперед находит в каждой позиции самый длинный вариант, не
+        поглощая текст, поэтому перекрывающиеся вхождения не теряются. Все
+        остальные варианты, начинающиеся в той же позиции, - префиксы
+        найденного, и их позиции добавляются по заранее построенной таблице.
+        Результат совпадает с _find_all_positions для каждого варианта.
+        
+        Args:
+            text_lower: Текст в нижнем регистре
+            variants: Непустые варианты написания в нижнем регистре
+            max_hits: Сколько первых позиций сохранять для варианта (None - все)
+            
+        Returns:
+            Словарь {вариант: позиции вхождений по возрастанию}
+        """
+        scanner = re.compile('(?=(' + _trie_alternation(variants) + '))')
+        # Вариант -> все варианты, которые являются его префиксами (включая его самого)
+        prefixes = {
+            variant: [variant[:size] for size in range(1, len(variant) + 1) if variant[:size] in variants]
+            for variant in variants
+        }
+        positions = {variant: array('q') for variant in variants}
+        for match in scanner.finditer(text_lower):
+            pos = match.start()
+            for variant in prefixes[match.group(1)]:
+                variant_positions = positions[variant]
+                if max_hits is None or len(variant_positions) < max_hits:
+                    variant_positions.append(pos)
+        return positions
+    
+    @staticmethod
+    def _keyword_hits_in(hits: Tuple[array, array], start: int, end: int) -> array:
+        """
+        Возвращает начала вхождений ключевых слов, целиком лежащих
+        в отрезке текста [start, end).
+        """
+        starts, ends = hits
+        return starts[bisect_left(starts, start):bisect_right(ends, end)]
+    
+    @staticmethod
+    def _has_position_near(positions: array, pos: int, radius: int) -> bool:
+        """
+        Проверяет, есть ли в отсортированном списке позиция на расстоянии
+        строго меньше radius от pos.
+        """
+        idx = bisect_right(positions, pos - radius)
+        return idx < len(positions) and positions[idx] < pos + radius
     
     def _create_bidirectional_relations(self, relations: List[Dict]) -> List[Dict]:
         """
@@ -96,217 +415,289 @@ class RelationExtractor:
         - FRIENDSHIP -> FRIENDSHIP (дружба двусторонняя)
         - WORK -> WORK (работа может быть двусторонней)
         - LOVE -> LOVE (любовь двусторонняя)
-        """
-        bidirectional_map = {
-            'RESIDENCE': 'HAS_RESIDENT',
-            'FAMILY': 'FAMILY',
-            'FRIENDSHIP': 'FRIENDSHIP',
-            'WORK': 'WORK',
-            'LOVE': 'LOVE'
-        }
-        
-        all_relations = list(relations)  # Копируем существующие связи
-        seen_reverse = set()  # Для предотвращения дублей
         
+        Для симметричных типов (FAMILY, FRIENDSHIP, LOVE) обратные связи
+        не добавляются.
+        """
+        # Первая связь для каждого ключа обратной связи
+        reverse_sources = {}
         for relation in relations:
             rel_type = relation['type']
-            source = relation['source']
-            target = relation['target']
-            
-            # Пропускаем, если связь уже двусторонняя
-            if rel_type in ['FAMILY', 'FRIENDSHIP', 'LOVE']:
-                # Для симметричных связей проверяем, нет ли уже обратной
-                reverse_key = (target, source, rel_type)
-                if reverse_key not in seen_reverse:
-                    seen_reverse.add(reverse_key)
-                    # Не добавляем, если уже есть обратная связь
-                    continue
-            
-            # Создаем обратную связь
-            reverse_type = bidirectional_map.get(rel_type)
+            if rel_type in self._SYMMETRIC:
+                continue
+            reverse_type = self._BIDI_MAP.get(rel_type)
             if reverse_type:
-                reverse_key = (target, source, reverse_type)
-                if reverse_key not in seen_reverse:
-                    seen_reverse.add(reverse_key)
-                    all_relations.append({
-                        'source': target,
-                        'target': source,
-                        'type': reverse_type,
-                        'confidence': relation.get('confidence', 0.5),
-                        'context': relation.get('context', ''),
-                        'source_type': relation.get('target_type', 'UNKNOWN'),
-                        'target_type': relation.get('source_type', 'UNKNOWN'),
-                        'is_reverse': True  # Метка обратной связи
-                    })
+                reverse_key = (relation['target'], relation['source'], reverse_type)
+                reverse_sources.setdefault(reverse_key, relation)
+        
+        all_relations = list(relations)  # Копируем существующие связи
+        all_relations.extend(self._make_reverse(relation, reverse_key[2])
+                             for reverse_key, relation in reverse_sources.items())
         
         return all_relations
     
-    def _extract_person_location_relations(self, text: str, entities: Dict[str, List[Dict]]) -> List[Dict]:
-        """Извлекает связи между персонами и локациями."""
-        relations = []
+    @staticmethod
+    def _make_reverse(relation: Dict, reverse_type: str) -> Dict:
+        """Строит обратную связь для relation с типом reverse_type."""
+        return {
+            'source': relation['target'],
+            'target': relation['source'],
+            'type': reverse_type,
+            'confidence': relation.get('confidence', 0.5),
+            'context': relation.get('context', ''),
+            'source_type': relation.get('target_type', 'UNKNOWN'),
+            'target_type': relation.get('source_type', 'UNKNOWN'),
+            'is_reverse': True  # Метка обратной связи
+        }
+    
+    @staticmethod
+    def _to_soa(entity_list: List[Dict]) -> SimpleNamespace:
+        """
+        Переводит список сущностей в набор параллельных столбцов.
+        Нормализация регистра и выделение первого слова имени выполняются
+        один раз, а не во вложенных циклах.
         
-        persons = entities.get('PERSON', [])
-        locations = entities.get('LOC', [])
+        Args:
+            entity_list: Список сущностей одного типа
+            
+        Returns:
+            Пространство имен со столбцами names, texts, starts, ends,
+            names_lower, texts_lower, first_lower и variants_lower
+            (непустые из: первое слово, нормализованное имя, исходный текст),
+            а также distinct - индексы первых сущностей с различными
+            (имя, варианты написания)
+        """
+        names = [entity['normalized'] for entity in entity_list]
+        texts = [entity['text'] for entity in entity_list]
+        names_lower = [name.lower() for name in names]
+        texts_lower = [entity_text.lower() for entity_text in texts]
+        first_lower = [name.split()[0] if name.strip() else '' for name in names_lower]
+        variants_lower = [tuple(variant for variant in variants if variant)
+                          for variants in zip(first_lower, names_lower, texts_lower)]
+        # Повторные упоминания с теми же вариантами дают те же результаты
+        # поиска по тексту, поэтому такие методы обходят только первые
+        distinct = {}
+        for entity_idx, key in enumerate(zip(names, variants_lower)):
+            distinct.setdefault(key, entity_idx)
+        return SimpleNamespace(
+            names=names,
+            texts=texts,
+            starts=[entity['start'] for entity in entity_list],
+            ends=[entity['end'] for entity in entity_list],
+            names_lower=names_lower,
+            texts_lower=texts_lower,
+            first_lower=first_lower,
+            variants_lower=variants_lower,
+            distinct=list(distinct.values()),
+        )
+    
+    def _location_forms(self, loc_normalized: str) -> Tuple[str, ...]:
+        """
+        Возвращает формы названия локации в косвенных падежах.
+        
+        Args:
+            loc_normalized: Название локации в нижнем регистре (именительный падеж)
+            
+        Returns:
+            Кортеж падежных форм в нижнем регистре
+        """
+        forms = self._loc_forms_cache.get(loc_normalized)
+        if forms is not None:
+            return forms
+        
+        if self.morph is None:
+            # Резервный вариант: основа без конечных гласных + типичные окончания
+            base = loc_normalized.rstrip('аеиоуыэюя')
+            forms = ()
+            if base and base != loc_normalized:
+                forms = tuple(base + ending for ending in self._LOC_CASE_ENDINGS)
+        else:
+            # Составные названия склоняются по словам ("нижний новгород" -> "нижнего новгорода")
+            parses = [self.morph.parse(word)[0] for word in loc_normalized.split()]
+            forms = []
+            for case in LOC_CASES:
+                words = []
+                for parsed in parses:
+                    inflected = parsed.inflect({case})
+                    words.append(inflected.word if inflected is not None else parsed.word)
+                form = ' '.join(words)
+                if form and form != loc_normalized and form not in forms:
+                    forms.append(form)
+            forms = tuple(forms)
         
-        if not persons or not locations:
-            return relations
+        # Экземпляр живет весь процесс, поэтому кэш ограничен по размеру
+        if len(self._loc_forms_cache) >= LOC_FORMS_CACHE_SIZE:
+            self._loc_forms_cache.clear()
+        self._loc_forms_cache[loc_normalized] = forms
+        return forms
+    
+    def _extract_person_location_relations(self, text: str, text_lower: str,
+                                           persons: SimpleNamespace, locations: SimpleNamespace,
+                                           keyword_hits: Dict[str, Tuple[array, array]],
+                                           mention_positions: Dict[str, array],
+                                           span_persons: SimpleNamespace = None) -> List[Dict]:
+        """
+        Извлекает связи между персонами и локациями.
+        Метод 1 использует позиции персон из span_persons (по умолчанию persons).
+        """
+        # Связи без дублей: (source, target, type) -> связь
+        relations = {}
+        
+        if not persons.names or not locations.names:
+            return []
         
-        # Создаем индексы для быстрого поиска
-        loc_map = {loc['normalized'].lower(): loc for loc in locations}
         # Создаем словарь всех вариантов написания локаций (оригинал + все найденные варианты)
         loc_text_variants = {}
-        for loc in locations:
-            loc_normalized = loc['normalized'].lower()
-            loc_original = loc['text'].lower()
-            loc_text_variants[loc_normalized] = loc
-            loc_text_variants[loc_original] = loc
+        for loc_idx, loc_normalized in enumerate(locations.names_lower):
+            loc_text_variants[loc_normalized] = loc_idx
+            loc_text_variants[locations.texts_lower[loc_idx]] = loc_idx
             # Добавляем варианты с падежами
-            base = loc_normalized.rstrip('аеиоуыэюя')
-            if base and base != loc_normalized:
-                for ending in ['а', 'е', 'и', 'у', 'ом', 'ой', 'е', 'ами']:
-                    loc_text_variants[base + ending] = loc
-        
-        # Метод 1: Поиск через паттерны
-        for person in persons:
-            person_name = person['normalized']
-            person_start = person['start']
-            person_end = person['end']
-            
-            # Ищем контекст вокруг персоны (окно в 300 символов)
-            context_start = max(0, person_start - 300)
-            context_end = min(len(text), person_end + 300)
-            context = text[context_start:context_end]
-            context_lower = context.lower()
-            
-            # Метод 1: Ищем ключевые слова места жительства в контексте
-            context_lower = context.lower()
-            for keyword in self.RESIDENCE_KEYWORDS:
-                if keyword in context_lower:
-                    # Найдено ключевое слово, ищем локацию рядом
-                    keyword_pos = context_lower.find(keyword)
-                    # Ищем локацию в окне ±100 символов от ключевого слова
-                    search_window = context[max(0, keyword_pos - 100):min(len(context), keyword_pos + 100)]
-                    search_window_lower = search_window.lower()
-                    
-                    for loc_variant, loc_data in loc_text_variants.items():
-                        # Проверяем, есть ли локация в окне поиска
-                        if loc_variant in search_window_lower or any(len(part) > 3 and part in search_window_lower 
-                                                                   for part in loc_variant.split()):
-                            relations.append({
-                                'source': person_name,
-                                'target': loc_data['normalized'],
-                                'type': 'RESIDENCE',
-                                'confidence': 0.8,
-                                'context': search_window.strip()[:150],
-                                'source_type': 'PERSON',
-                                'target_type': 'LOC'
-                            })
+            for loc_form in self._location_forms(loc_normalized):
+                loc_text_variants[loc_form] = loc_idx
+        # Слова длиннее 3 символов выделяются из вариантов один раз:
+        # составную локацию можно найти и по отдельному слову
+        loc_variant_parts = [
+            (loc_variant, loc_idx, tuple(part for part in loc_variant.split() if len(part) > 3))
+            for loc_variant, loc_idx in loc_text_variants.items()
+        ]
+        
+        # Метод 1: Поиск через паттерны. Проход идет по вхождениям ключевых
+        # слов места жительства; персоны, в контекст которых (±300 символов)
+        # попадает ключевое слово, находятся бинарным поиском по началам
+        if span_persons is None:
+            span_persons = persons
+        person_order = sorted(range(len(span_persons.names)), key=span_persons.starts.__getitem__)
+        person_starts = [span_persons.starts[person_idx] for person_idx in person_order]
+        max_person_len = max((end - start for start, end in zip(span_persons.starts, span_persons.ends)),
+                             default=0)
+        # Найденная локация по границам окна поиска: у одного ключевого слова
+        # окна разных персон обычно совпадают
+        window_locations = {}
+        find = text_lower.find
+        
+        for hit, hit_end in zip(*keyword_hits['RESIDENCE']):
+            lo = bisect_left(person_starts, hit_end - 300 - max_person_len)
+            hi = bisect_right(person_starts, hit + 300)
+            for person_idx in person_order[lo:hi]:
+                person_end = span_persons.ends[person_idx]
+                if person_end + 300 < hit_end:
+                    continue
+                
+                # Ищем локацию в окне ±100 символов от ключевого слова,
+                # не выходя за контекст персоны
+                window_start = max(0, span_persons.starts[person_idx] - 300, hit - 100)
+                window_end = min(len(text), person_end + 300, hit + 100)
+                window = (window_start, window_end)
+                if window not in window_locations:
+                    window_locations[window] = None
+                    for loc_variant, loc_idx, loc_parts in loc_variant_parts:
+                        # Проверяем, есть ли локация в окне поиска (поиск в границах
+                        # окна по тексту в нижнем регистре, без копирования среза)
+                        if find(loc_variant, window_start, window_end) != -1 or any(
+                                find(part, window_start, window_end) != -1 for part in loc_parts):
+                            window_locations[window] = loc_idx
                             break
+                
+                loc_idx = window_locations[window]
+                if loc_idx is not None:
+                    self._keep_best(relations, {
+                        'source': span_persons.names[person_idx],
+                        'target': locations.names[loc_idx],
+                        'type': 'RESIDENCE',
+                        'confidence': 0.8,
+                        'context': text[window_start:window_end].strip()[:150],
+                        'source_type': 'PERSON',
+                        'target_type': 'LOC'
+                    })
+        
+        # Метод 2: Поиск близких упоминаний (персона и локация рядом).
+        # Упоминания всех локаций собираются в один отсортированный массив,
+        # и локации рядом с упоминанием персоны находятся бинарным поиском
+        loc_mentions = []
+        for loc_idx in range(len(locations.names)):
+            # Ищем все варианты написания локации
+            loc_positions = []
+            for loc_variant in [locations.names_lower[loc_idx], locations.texts_lower[loc_idx]]:
+                if loc_variant:
+                    loc_positions.extend(mention_positions[loc_variant])
+            loc_mentions.extend((l_pos, loc_idx) for l_pos in sorted(set(loc_positions))[:20])
+        loc_mentions.sort()
+        loc_mention_positions = array('q', (l_pos for l_pos, _ in loc_mentions))
         
-        # Метод 2: Поиск близких упоминаний (персона и локация рядом)
-        person_name_variants = {}  # Все варианты написания имен персон
-        for person in persons:
-            person_normalized = person['normalized']
-            person_original = person['text']
-            person_name_variants[person_normalized.lower()] = person
-            person_name_variants[person_original.lower()] = person
-            # Добавляем первое имя
-            first_name = person_normalized.split()[0] if person_normalized else ''
-            if first_name:
-                person_name_variants[first_name.lower()] = person
-        
-        for person in persons:
-            person_name = person['normalized']
-            person_first_name = person_name.split()[0] if person_name else ''
-            if not person_first_name:
+        for person_idx in persons.distinct:
+            person_name = persons.names[person_idx]
+            if not persons.first_lower[person_idx]:
                 continue
                 
             # Ищем все упоминания персоны (по первому имени и полному имени)
             person_positions = []
-            for variant in [person_first_name, person_name]:
-                if variant:
-                    person_positions.extend(self._find_all_positions(text, variant))
+            for variant in persons.variants_lower[person_idx][:2]:
+                person_positions.extend(mention_positions[variant])
             
             # Убираем дубликаты и сортируем
             person_positions = sorted(set(person_positions))[:20]
             
-            for loc in locations:
-                loc_name = loc['normalized']
-                loc_original = loc['text']
-                
-                # Ищем все варианты написания локации
-                loc_positions = []
-                for loc_variant in [loc_name, loc_original]:
-                    if loc_variant:
-                        loc_positions.extend(self._find_all_positions(text, loc_variant))
-                
-                loc_positions = sorted(set(loc_positions))[:20]
-                
-                # Проверяем, находятся ли персона и локация рядом
-                for p_pos in person_positions:
-                    for l_pos in loc_positions:
-                        distance = abs(p_pos - l_pos)
-                        if distance < 200:  # Увеличиваем радиус поиска
-                            # Берем контекст между ними
-                            min_pos = min(p_pos, l_pos)
-                            max_pos = max(p_pos, l_pos)
-                            context = text[max(0, min_pos - 100):min(len(text), max_pos + 100)]
-                            
-                            # Проверяем наличие ключевых слов связи
-                            context_lower = context.lower()
-                            if any(keyword in context_lower for keyword in self.RESIDENCE_KEYWORDS):
-                                relations.append({
-                                    'source': person_name,
-                                    'target': loc_name,
-                                    'type': 'RESIDENCE',
-                                    'confidence': 0.75,
-                                    'context': context.strip()[:150],
-                                    'source_type': 'PERSON',
-                                    'target_type': 'LOC'
-                                })
-                                break
-        
-        # Убираем дубликаты
-        seen = set()
-        unique_relations = []
-        for rel in relations:
-            key = (rel['source'], rel['target'], rel['type'])
-            if key not in seen:
-                seen.add(key)
-                unique_relations.append(rel)
-        
-        return unique_relations
+            # Для каждой локации берется первая подходящая пара упоминаний
+            linked_locations = {}  # {индекс локации: окно контекста}
+            for p_pos in person_positions:
+                # Локации на расстоянии меньше 200 символов от персоны
+                lo = bisect_right(loc_mention_positions, p_pos - 200)
+                hi = bisect_left(loc_mention_positions, p_pos + 200)
+                for l_pos, loc_idx in loc_mentions[lo:hi]:
+                    if loc_idx in linked_locations:
+                        continue
+                    
+                    # Берем контекст между ними
+                    min_pos = min(p_pos, l_pos)
+                    max_pos = max(p_pos, l_pos)
+                    window_start = max(0, min_pos - 100)
+                    window_end = min(len(text), max_pos + 100)
+                    
+                    # Проверяем наличие ключевых слов связи
+                    if self._keyword_hits_in(keyword_hits['RESIDENCE'], window_start, window_end):
+                        linked_locations[loc_idx] = (window_start, window_end)
+            
+            # Связи добавляются в порядке списка локаций, а не упоминаний в тексте
+            for loc_idx in sorted(linked_locations):
+                window_start, window_end = linked_locations[loc_idx]
+                self._keep_best(relations, {
+                    'source': person_name,
+                    'target': locations.names[loc_idx],
+                    'type': 'RESIDENCE',
+                    'confidence': 0.75,
+                    'context': text[window_start:window_end].strip()[:150],
+                    'source_type': 'PERSON',
+                    'target_type': 'LOC'
+                })
+        
+        return list(relations.values())
     
-    def _extract_person_person_relations(self, text: str, entities: Dict[str, List[Dict]]) -> List[Dict]:
+    def _extract_person_person_relations(self, text: str, text_lower: str,
+                                         persons: SimpleNamespace, keyword_hits: Dict[str, Tuple[array, array]],
+                                         mention_positions: Dict[str, array]) -> List[Dict]:
         """Извлекает связи между персонами через поиск ключевых слов."""
-        relations = []
-        persons = entities.get('PERSON', [])
+        # Связи без дублей: (source, target, type) -> связь
+        relations = {}
         
-        if len(persons) < 2:
-            return relations
+        if len(persons.names) < 2:
+            return []
         
-        # Типы связей с их ключевыми словами
-        relation_types_keywords = [
-            (self.FAMILY_KEYWORDS, 'FAMILY'),
-            (self.FRIENDSHIP_KEYWORDS, 'FRIENDSHIP'),
-            (self.WORK_KEYWORDS, 'WORK'),
-            (self.LOVE_KEYWORDS, 'LOVE'),
-        ]
+        # Отсортированные упоминания второго персонажа, по индексу персоны;
+        # считаются один раз при первой надобности
+        p2_positions_cache = {}
+        find = text_lower.find
         
         # Ищем связи через ключевые слова
-        for person1 in persons:
-            p1_name = person1['normalized']
-            p1_first = p1_name.split()[0] if p1_name else ''
-            p1_original = person1['text']
-            
+        for p1_idx in persons.distinct:
+            p1_name = persons.names[p1_idx]
+            p1_first = persons.first_lower[p1_idx]
             if not p1_first:
                 continue
             
             # Ищем все упоминания первого персонажа (по всем вариантам)
             p1_positions = []
-            for variant in [p1_first, p1_name, p1_original]:
-                if variant:
-                    p1_positions.extend(self._find_all_positions(text, variant))
+            for variant in persons.variants_lower[p1_idx]:
+                p1_positions.extend(mention_positions[variant])
             
             p1_positions = sorted(set(p1_positions))[:30]
             
@@ -314,75 +705,93 @@ class RelationExtractor:
                 # Контекст вокруг упоминания
                 context_start = max(0, p1_pos - 300)
                 context_end = min(len(text), p1_pos + len(p1_first) + 300)
-                context = text[context_start:context_end]
-                context_lower = context.lower()
                 
                 # Проверяем каждый тип связи через ключевые слова
-                for keywords, relation_type in relation_types_keywords:
+                for relation_type in self._PERSON_RELATION_TYPES:
                     # Ищем ключевые слова в контексте
-                    for keyword in keywords:
-                        if keyword in context_lower:
-                            keyword_pos = context_lower.find(keyword)
-                            # Ищем второго персонажа в окне ±150 символов от ключевого слова
-                            search_window = context[max(0, keyword_pos - 150):min(len(context), keyword_pos + 150)]
-                            search_window_lower = search_window.lower()
+                    for hit in self._keyword_hits_in(keyword_hits[relation_type], context_start, context_end):
+                        # Ищем второго персонажа в окне ±150 символов от ключевого слова
+                        window_start = max(context_start, hit - 150)
+                        window_end = min(context_end, hit + 150)
+                        
+                        # Ищем второго персонажа в окне поиска
+                        for p2_idx in persons.distinct:
+                            p2_name = persons.names[p2_idx]
+                            if p1_name == p2_name or not persons.first_lower[p2_idx]:
+                                continue
+                            p2_variants = persons.variants_lower[p2_idx]
                             
-                            # Ищем второго персонажа в окне поиска
-                            for person2 in persons:
-                                if person1['normalized'] == person2['normalized']:
-                                    continue
-                                
-                                p2_name = person2['normalized']
-                                p2_variants = [p2_name.lower(), person2['text'].lower()]
-                                p2_first = p2_name.split()[0] if p2_name else ''
-                                if p2_first:
-                                    p2_variants.append(p2_first.lower())
-                                
-                                if not p2_first:
-                                    continue
-                                
-                                # Проверяем, есть ли второе имя в окне поиска
-                                if any(variant in search_window_lower for variant in p2_variants if variant):
-                                    # Проверяем расстояние между упоминаниями в тексте
+                            # Проверяем, есть ли второе имя в окне поиска
+                            if any(find(variant, window_start, window_end) != -1 for variant in p2_variants):
+                                # Проверяем расстояние между упоминаниями в тексте
+                                p2_positions = p2_positions_cache.get(p2_idx)
+                                if p2_positions is None:
                                     p2_positions = []
-                                    for variant in [p2_first, p2_name, person2['text']]:
-                                        if variant:
-                                            p2_positions.extend(self._find_all_positions(text, variant))
-                                    
-                                    if any(abs(p1_pos - p2_pos) < 600 for p2_pos in p2_positions[:20]):
-                                        relations.append({
-                                            'source': p1_name,
-                                            'target': p2_name,
-                                            'type': relation_type,
-                                            'confidence': 0.75,
-                                            'context': search_window.strip()[:150],
-                                            'source_type': 'PERSON',
-                                            'target_type': 'PERSON'
-                                        })
-                                        break
-        
-        # Убираем дубликаты
-        seen = set()
-        unique_relations = []
-        for rel in relations:
-            key = (rel['source'], rel['target'], rel['type'])
-            reverse_key = (rel['target'], rel['source'], rel['type'])
-            # Не добавляем обратные связи
-            if key not in seen and reverse_key not in seen:
-                seen.add(key)
-                unique_relations.append(rel)
-        
-        return unique_relations
+                                    for variant in p2_variants:
+                                        p2_positions.extend(mention_positions[variant])
+                                    p2_positions = array('q', sorted(p2_positions[:20]))
+                                    p2_positions_cache[p2_idx] = p2_positions
+                                
+                                if self._has_position_near(p2_positions, p1_pos, 600):
+                                    # Обратная связь попадает в тот же ключ и не добавляется
+                                    self._keep_best(relations, {
+                                        'source': p1_name,
+                                        'target': p2_name,
+                                        'type': relation_type,
+                                        'confidence': 0.75,
+                                        'context': text[window_start:window_end].strip()[:150],
+                                        'source_type': 'PERSON',
+                                        'target_type': 'PERSON'
+                                    })
+                                    break
+        
+        return list(relations.values())
+    
+    @classmethod
+    def _canonical_key(cls, relation: Dict) -> Tuple[str, str, str]:
+        """
+        Ключ связи для поиска дублей. Связи между персонами ищутся без учета
+        направления, поэтому A->B и B->A одного типа дают один ключ
+        (имена упорядочены); для остальных связей ключ (source, target, type).
+        """
+        source, target, rel_type = relation['source'], relation['target'], relation['type']
+        if rel_type in cls._PERSON_RELATION_TYPES and target < source:
+            return target, source, rel_type
+        return source, target, rel_type
+    
+    @classmethod
+    def _keep_best(cls, relations: Dict[Tuple[str, str, str], Dict], relation: Dict) -> None:
+        """
+        Добавляет связь в словарь без дублей; из связей с одинаковым
+        ключом (см. _canonical_key) остается связь с наибольшей уверенностью,
+        при равной - добавленная первой.
+        """
+        key = cls._canonical_key(relation)
+        current = relations.get(key)
+        if current is None or relation['confidence'] > current['confidence']:
+            relations[key] = relation
     
-    def _find_all_positions(self, text: str, substring: str) -> List[int]:
-        """Находит все позиции подстроки в тексте."""
-        positions = []
+    def _find_all_positions(self, text_lower: str, substring_lower: str, max_hits: int = None) -> array:
+        """
+        Находит все позиции подстроки в тексте.
+        
+        Args:
+            text_lower: Текст, уже приведенный к нижнему регистру
+            substring_lower: Подстрока в нижнем регистре
+            max_hits: Остановить поиск после стольких вхождений (None - искать все)
+            
+        Returns:
+            Позиции всех (в том числе перекрывающихся) вхождений по возрастанию
+        """
+        positions = array('q')
         start = 0
         while True:
-            pos = text.lower().find(substring.lower(), start)
+            pos = text_lower.find(substring_lower, start)
             if pos == -1:
                 break
             positions.append(pos)
+            if len(positions) == max_hits:
+                break
             start = pos + 1
         return positions
 
@@ -0,0 +1,91 @@
+"""
+Модуль для определения кодировки и декодирования текстовых файлов.
+Используется веб-приложением (app.py) и консольной версией (main.py).
+"""
+from typing import Optional
+
+try:
+    from charset_normalizer import from_bytes
+except ImportError:
+    from_bytes = None
+
+try:
+    import chardet
+except ImportError:
+    chardet = None
+
+# Размер начального фрагмента файла, по которому определяется кодировка
+ENCODING_SAMPLE_SIZE = 64 * 1024
+
+# Кодировки, которые пробуются, если определенная автоматически не подошла
+ENCODINGS = ('utf-8', 'windows-1251', 'cp866', 'iso-8859-5')
+
+# Метки порядка байтов (BOM), однозначно задающие кодировку файла
+BOMS = (
+    (b'\xef\xbb\xbf', 'utf-8-sig'),
+    (b'\xff\xfe', 'utf-16'),
+    (b'\xfe\xff', 'utf-16'),
+)
+
+
+def detect_encoding(raw_data: bytes) -> Optional[str]:
+    """
+    Определяет кодировку по начальному фрагменту файла.
+    Используется charset_normalizer, если он установлен, иначе chardet.
+    
+    Args:
+        raw_data: Содержимое файла (анализируются первые ENCODING_SAMPLE_SIZE байт)
+        
+    Returns:
+        Название кодировки или None, если определить не удалось
+    """
+    sample = raw_data[:ENCODING_SAMPLE_SIZE]
+    try:
+        if from_bytes is not None:
+            best = from_bytes(sample).best()
+            return best.encoding if best is not None else None
+        if chardet is not None:
+            return (chardet.detect(sample) or {}).get('encoding')
+    except Exception:
+        pass  # Ошибка детектора - вызывающий код пробует список кодировок
+    return None  # Детекторы не установлены или не справились
+
+
+def _decode(raw_data: bytes, encoding: str, errors: str = 'strict') -> str:
+    """Декодирует байты и приводит переводы строк к '\\n', как при чтении в текстовом режиме."""
+    text = raw_data.decode(encoding, errors)
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text
+
+
+def decode_text(raw_data: bytes) -> str:
+    """
+    Декодирует содержимое текстового файла с автоматическим определением кодировки.
+    Все попытки декодирования идут в памяти, файл читается вызывающим кодом один раз.
+    
+    Args:
+        raw_data: Содержимое файла
+        
+    Returns:
+        Текст с переводами строк '\\n'
+    """
+    # Файлы с BOM не требуют статистического определения кодировки
+    encoding = next((enc for bom, enc in BOMS if raw_data.startswith(bom)), None)
+    if encoding is None:
+        # Быстрый путь: корректный UTF-8 (самый частый случай) декодируется
+        # сразу, без определения кодировки
+        try:
+            return _decode(raw_data, 'utf-8')
+        except UnicodeDecodeError:
+            encoding = detect_encoding(raw_data)
+    
+    # Сначала определенная кодировка, затем список, в крайнем случае
+    # декодирование с заменой ошибочных символов
+    candidates = (encoding,) + ENCODINGS if encoding else ENCODINGS
+    for candidate in candidates:
+        try:
+            return _decode(raw_data, candidate)
+        except (UnicodeDecodeError, LookupError):
+            continue
+    return _decode(raw_data, 'utf-8', errors='replace')
@@ -0,0 +1,16 @@
+"""
+WSGI точка входа для запуска веб-приложения в production.
+
+Пример запуска:
+    gunicorn --preload -w 4 -k gthread --threads 2 wsgi:application
+
+С --preload модели Natasha и pymorphy2 загружаются один раз в master-процессе
+до fork и разделяются воркерами (copy-on-write).
+"""
+from app import app, get_entity_extractor, get_relation_extractor
+
+# Создаем экземпляры заранее, чтобы они попали в память до fork
+get_entity_extractor()
+get_relation_extractor()
+
+application = app